@@ -1,4 +1,4 @@
-from led import LEDBase, LEDStrip, LEDPOV, LEDMatrix, LEDCircle, mapGen, MultiMapBuilder, MatrixRotation
+from led import LEDBase, LEDStrip, LEDPOV, LEDMatrix, LEDCircle, mapGen, MultiMapBuilder, MatrixRotation, UpdatePolicy, TextScroller
 import log
 import colors
 
@@ -6,7 +6,8 @@ from led import LEDStrip
 from led import LEDCircle
 import colors
 
-from util import d
+from util import d, monotonic
+from metrics import FrameMetrics
 
 import threading
 
@@ -24,6 +25,21 @@ class animThread(threading.Thread):
         log.logger.info("Thread Complete")
 
 
+class OverloadPolicy:
+    """
+    What run does when step() and update() take longer than the frame time.
+    NONE - carry on, so the animation slows down
+    SKIP_FRAME - step once over the frames that were missed, by amt times
+        the number of frames, without drawing or sending them
+    DROP_UPDATE - skip sending the next frame to the display to catch up
+    ADAPTIVE_FPS - lower the framerate to what can be kept up with, and
+        raise it back towards the requested fps as frames get faster
+    """
+    NONE = 0
+    SKIP_FRAME = 1
+    DROP_UPDATE = 2
+    ADAPTIVE_FPS = 3
+
 class BaseAnimation(object):
     def __init__(self, led):
         self._led = led
@@ -36,10 +52,41 @@ class BaseAnimation(object):
         self._callback = None
         self._stopEvent = threading.Event()
         self._stopEvent.clear()
+        self._spinTime = 2.0
+        self._warnInterval = 5000
+        self.overloadPolicy = OverloadPolicy.NONE
+        self.elapsedTime = 0
+        self.skippedFrames = 0
+        self.droppedUpdates = 0
+        self.currentFps = None
+        self.metrics = FrameMetrics()
+        self._virtualTime = None
 
     def _msTime(self):
+        if self._virtualTime is not None:
+            return self._virtualTime
         return time.time() * 1000.0
 
+    def _monoTime(self):
+        if self._virtualTime is not None:
+            return self._virtualTime
+        return monotonic() * 1000.0
+
+    def _waitUntil(self, target):
+        """
+        Waits until _monoTime() reaches target. Sleeps until _spinTime ms
+        before it, then spins for the rest to avoid sleep wake-up jitter
+        """
+        remaining = target - self._monoTime()
+        if remaining > self._spinTime:
+            t = (remaining - self._spinTime) / 1000.0
+            if self._threaded:
+                self._stopEvent.wait(t)
+            else:
+                time.sleep(t)
+        while self._monoTime() < target and not self._stopEvent.isSet():
+            pass
+
     def preRun(self, amt=1):
         self._led.all_off()
 
@@ -83,32 +130,81 @@ class BaseAnimation(object):
         else:
             return True
 
-    def _run(self, amt, fps, sleep, max_steps, untilComplete, max_cycles):
+    def _noteOverrun(self, frameTime, took):
+        """Counts a frame that overran, logging a summary every _warnInterval ms"""
+        self._overruns += 1
+        self._worstFrame = max(self._worstFrame, took)
+        if self._monoTime() - self._lastWarning >= self._warnInterval:
+            self._warnOverruns(frameTime)
+
+    def _warnOverruns(self, frameTime):
+        now = self._monoTime()
+        log.logger.warning("Frame-time of %dms set, but %d frame(s) took longer in the last %ds, up to %dms!" %
+            (frameTime, self._overruns, (now - self._lastWarning) / 1000, self._worstFrame))
+        self._lastWarning = now
+        self._overruns = 0
+        self._worstFrame = 0
+
+    def _run(self, amt, fps, sleep, max_steps, untilComplete, max_cycles, deadline=False, overload=OverloadPolicy.NONE):
         self.preRun()
         # calculate sleep time base on desired Frames per Second
         if fps is not None:
             sleep = int(1000 / fps)
 
         initSleep = sleep
+        # deadline mode schedules frames at exact multiples of the frame
+        # time on the monotonic clock, so use the untruncated value
+        initPeriod = 1000.0 / fps if fps is not None else sleep
+        nextFrame = self._monoTime()
 
         self._step = 0
         cur_step = 0
         cycle_count = 0
         self.animComplete = False
 
+        self.overloadPolicy = overload
+        self.elapsedTime = 0
+        self.skippedFrames = 0
+        self.droppedUpdates = 0
+        self.currentFps = fps
+        self._overruns = 0
+        self._worstFrame = 0
+        self._lastWarning = nextFrame
+        metrics = self.metrics
+        metrics.reset()
+        drivers = self._led.driver if isinstance(self._led.driver, list) else [self._led.driver]
+        lastStart = None
+        behind = 0 # whole frames the previous frames overran by
+        debt = 0 # overrun time not yet made up by skipping frames
+        adapt = 1.0 # frame time multiplier for ADAPTIVE_FPS
+        avgWork = None # smoothed step and update time for ADAPTIVE_FPS
+
         while not self._stopEvent.isSet() and (
                  (max_steps == 0 and not untilComplete) or
                  (max_steps > 0 and cur_step < max_steps) or
                  (max_steps == 0 and untilComplete and not self.animComplete)):
 
             self._timeRef = self._msTime()
+            frameStart = self._monoTime()
+            if lastStart is not None:
+                self.elapsedTime = frameStart - lastStart
+            lastStart = frameStart
+
+            stepAmt = amt
+            if overload == OverloadPolicy.SKIP_FRAME and behind:
+                # advance over the frames that were not rendered in time
+                stepAmt = amt * (behind + 1)
+                self.skippedFrames += behind
+                cur_step += behind
+            dropUpdate = overload == OverloadPolicy.DROP_UPDATE and behind > 0
+            behind = 0
 
             start = self._msTime()
             if hasattr(self, "_input_dev"):
                 self._keys = self._input_dev.getKeys()
-            self.preStep(amt)
-            self.step(amt)
-            self.postStep(amt)
+            self.preStep(stepAmt)
+            self.step(stepAmt)
+            self.postStep(stepAmt)
             mid = self._msTime()
 
             if self._internalDelay:
@@ -119,7 +215,10 @@ class BaseAnimation(object):
             self._led._frameGenTime = int(mid - start)
             self._led._frameTotalTime = sleep
 
-            self._led.update()
+            if dropUpdate:
+                self.droppedUpdates += 1
+            else:
+                self._led.update()
             now = self._msTime()
 
             if self.animComplete and max_cycles > 0:
@@ -135,29 +234,91 @@ class BaseAnimation(object):
                 updateTime = int(now - mid)
                 totalTime = stepTime + updateTime
 
+            if log.logger.isEnabledFor(log.DEBUG):
+                if self._led._threadedUpdate:
+                    log.logger.debug("Id {} Frame: {}ms / Update Max: {}ms".format(id(self), stepTime, updateTime))
+                else:
+                    log.logger.debug("{}ms/{}fps / Frame: {}ms / Update: {}ms".format(totalTime, int(1000 / max(totalTime,1)), stepTime, updateTime))
+
+            fixTime = 0
+            for drv in drivers:
+                fixTime += drv.lastFixTime
             if self._led._threadedUpdate:
-                log.logger.debug("Id {} Frame: {}ms / Update Max: {}ms".format(id(self), stepTime, updateTime))
+                sendTime = self._led.lastThreadedUpdate()
             else:
-                log.logger.debug("{}ms/{}fps / Frame: {}ms / Update: {}ms".format(totalTime, int(1000 / max(totalTime,1)), stepTime, updateTime))
+                sendTime = now - mid
+            late = 0
+            sleepStart = self._monoTime()
 
             if sleep:
-                diff = (self._msTime() - self._timeRef)
-                t = max(0, (sleep - diff) / 1000.0)
-                if t == 0:
-                    log.logger.warning("Frame-time of %dms set, but took %dms!" % (sleep, diff))
-                if self._threaded:
-                    self._stopEvent.wait(t)
+                if overload == OverloadPolicy.ADAPTIVE_FPS:
+                    base = (self._internalDelay or initPeriod) if deadline else sleep
+                    work = self._monoTime() - frameStart
+                    # follow an average so that the odd slow frame doesn't
+                    # drag the framerate down, backing off gradually and
+                    # recovering as soon as the average fits again
+                    avgWork = work if avgWork is None else avgWork + (work - avgWork) * 0.1
+                    target = min(max(1.0, avgWork * 1.2 / base), 10.0)
+                    if target > adapt:
+                        adapt += (target - adapt) * 0.25
+                    else:
+                        adapt = target
+                    self.currentFps = 1000.0 / (base * adapt)
+
+                if deadline:
+                    frameTime = (self._internalDelay or initPeriod) * adapt
+                    nextFrame += frameTime
+                    late = self._monoTime() - nextFrame
+                else:
+                    frameTime = sleep * adapt
+                    late = (self._msTime() - self._timeRef) - frameTime
+
+                if late > 0:
+                    self._noteOverrun(frameTime, frameTime + late)
+                    if deadline:
+                        behind = int(late // frameTime)
+                        if overload == OverloadPolicy.SKIP_FRAME:
+                            # give up the slots of the skipped frames
+                            nextFrame += behind * frameTime
+                        elif late > frameTime:
+                            # too far behind to catch up, start again from now
+                            nextFrame += late
+                    else:
+                        debt += late
+                        behind = int(debt // frameTime)
+                        debt -= behind * frameTime
+                elif deadline:
+                    self._waitUntil(nextFrame)
                 else:
-                    time.sleep(t)
+                    t = -late / 1000.0
+                    if self._threaded:
+                        self._stopEvent.wait(t)
+                    else:
+                        time.sleep(t)
+
+            frameEnd = self._monoTime()
+            metrics.record(mid - start, fixTime, max(0, sendTime - fixTime), frameEnd - sleepStart, frameEnd - frameStart, late > 0)
             cur_step += 1
 
+        if self._overruns:
+            self._warnOverruns(frameTime)
+
         self.animComplete = True
         self.postRun()
 
         if self._callback:
             self._callback(self)
 
-    def run(self, amt = 1, fps=None, sleep=None, max_steps = 0, untilComplete = False, max_cycles = 0, threaded = False, joinThread = False, callback=None):
+    def run(self, amt = 1, fps=None, sleep=None, max_steps = 0, untilComplete = False, max_cycles = 0, threaded = False, joinThread = False, callback=None, deadline = False, overload = OverloadPolicy.NONE):
+        """
+        deadline - if True, frames are timed against absolute deadlines on a
+        monotonic clock instead of sleeping for what is left of each frame,
+        so the average framerate stays exactly at fps without drifting
+        overload - an OverloadPolicy for frames that take too long. While
+        running, overloadPolicy, elapsedTime (ms since the previous frame
+        started), skippedFrames, droppedUpdates and currentFps can be read
+        by step() to keep time based effects in step with the real time
+        """
 
         self._threaded = threaded
         if self._threaded:
@@ -167,7 +328,7 @@ class BaseAnimation(object):
         if self._threaded:
             args = {}
             l = locals()
-            run_params = ["amt", "fps", "sleep", "max_steps", "untilComplete", "max_cycles"]
+            run_params = ["amt", "fps", "sleep", "max_steps", "untilComplete", "max_cycles", "deadline", "overload"]
             for p in run_params:
                 if p in l:
                     args[p] = l[p]
@@ -176,7 +337,77 @@ class BaseAnimation(object):
             if joinThread:
                 self._thread.join()
         else:
-            self._run(amt, fps, sleep, max_steps, untilComplete, max_cycles)
+            self._run(amt, fps, sleep, max_steps, untilComplete, max_cycles, deadline, overload)
+
+    def render(self, duration = 0, fps = 30, amt = 1, max_steps = 0, untilComplete = False, sink = None):
+        """
+        Renders the animation as fast as possible instead of in real time.
+        Time, as seen through _msTime(), is a virtual clock that starts at 0
+        and advances by the frame time every frame, so the output is the
+        same as run() would give at that framerate.
+        duration - ms of animation to render, or 0 for no limit
+        max_steps - frames to render, or 0 for no limit
+        untilComplete - stop once the animation marks itself as complete
+        sink - where each frame goes:
+            None sends it to the LED drivers with update(),
+            a path writes it to a DriverRecorder file,
+            a DriverRecorder gets it through writeFrame(buffer, timestamp),
+            anything else with update(), such as DriverImageSequence, gets update(buffer),
+            any other callable is called as sink(buffer, timestamp)
+        Returns the number of frames rendered
+        """
+        if not duration and not max_steps and not untilComplete:
+            raise ValueError("Must give a duration, max_steps or untilComplete to render")
+
+        close = None
+        if isinstance(sink, basestring):
+            from drivers.recorder import DriverRecorder
+            # the buffer size, as numLEDs leaves out a matrix pixelSize
+            sink = close = DriverRecorder(self._led.bufByteCount / 3, sink)
+
+        if sink is None:
+            output = lambda buf, t: self._led.update()
+        elif hasattr(sink, "writeFrame"):
+            output = sink.writeFrame
+        elif hasattr(sink, "update"):
+            output = lambda buf, t: sink.update(buf)
+        else:
+            output = sink
+
+        frames = 0
+        base = self._virtualTime = 0.0
+        count = 0
+        try:
+            self.preRun()
+            self._step = 0
+            self.animComplete = False
+            self.elapsedTime = 0
+            while ((not duration or self._virtualTime < duration) and
+                   (not max_steps or frames < max_steps) and
+                   not (untilComplete and self.animComplete)):
+                self._timeRef = self._virtualTime
+                self.preStep(amt)
+                self.step(amt)
+                self.postStep(amt)
+                output(self._led.buffer, self._virtualTime)
+                frames += 1
+
+                # count fixed length frames from a base so rounding can't add up
+                last = self._virtualTime
+                if self._internalDelay:
+                    base = self._virtualTime = last + self._internalDelay
+                    count = 0
+                else:
+                    count += 1
+                    self._virtualTime = base + count * 1000.0 / fps
+                self.elapsedTime = self._virtualTime - last
+            self.animComplete = True
+            self.postRun()
+        finally:
+            self._virtualTime = None
+            if close:
+                close.close()
+        return frames
 
     RUN_PARAMS = [{
                 "id": "amt",
@@ -212,6 +443,24 @@ class BaseAnimation(object):
                 "min": 1,
                 "default": 1,
                 "help":"If Until Complete is set, animation will repeat this many times."
+            },{
+                "id": "deadline",
+                "label": "Deadline Timing",
+                "type": "bool",
+                "default": False,
+                "help":"Time frames against a drift-free monotonic clock, for exact average framerates."
+            },{
+                "id": "overload",
+                "label": "Overload Policy",
+                "type": "combo",
+                "options": {
+                    0: "Slow Down",
+                    1: "Skip Frames",
+                    2: "Drop Updates",
+                    3: "Adaptive Framerate"
+                },
+                "default": 0,
+                "help":"What to do when frames take longer than the frame time."
             },]
 
 class OffAnim(BaseAnimation):
@@ -232,6 +481,8 @@ class AnimationQueue(BaseAnimation):
         self.animIndex = 0;
         self._internalDelay = 0 #never wait
         self.fps = None
+        self.deadline = False
+        self.overload = OverloadPolicy.NONE
         self.untilComplete = False
 
     #overriding to handle all the animations
@@ -241,7 +492,7 @@ class AnimationQueue(BaseAnimation):
             a._stopEvent.set()
         super(AnimationQueue, self).stopThread(wait)
 
-    def addAnim(self, anim, amt = 1, fps=None, max_steps = 0, untilComplete = False, max_cycles = 0):
+    def addAnim(self, anim, amt = 1, fps=None, max_steps = 0, untilComplete = False, max_cycles = 0, deadline = None, overload = None):
         a = (
             anim,
             {
@@ -249,7 +500,9 @@ class AnimationQueue(BaseAnimation):
                 "fps": fps,
                 "max_steps": max_steps,
                 "untilComplete": untilComplete,
-                "max_cycles": max_cycles
+                "max_cycles": max_cycles,
+                "deadline": deadline,
+                "overload": overload
             }
         )
         self.anims.append(a)
@@ -259,8 +512,10 @@ class AnimationQueue(BaseAnimation):
             raise Exception("Must provide at least one animation.")
         self.animIndex = -1
 
-    def run(self, amt = 1, fps=None, sleep=None, max_steps = 0, untilComplete = False, max_cycles = 0, threaded = False, joinThread = False, callback=None):
+    def run(self, amt = 1, fps=None, sleep=None, max_steps = 0, untilComplete = False, max_cycles = 0, threaded = False, joinThread = False, callback=None, deadline = False, overload = OverloadPolicy.NONE):
         self.fps = fps
+        self.deadline = deadline
+        self.overload = overload
         self.untilComplete = untilComplete
         self.max_cycles = max_cycles
         super(AnimationQueue, self).run(amt = 1, fps=None, sleep=None, max_steps = 0, untilComplete = untilComplete, max_cycles = max_cycles, threaded = threaded, joinThread = joinThread, callback=callback)
@@ -284,7 +539,16 @@ class AnimationQueue(BaseAnimation):
 
             if run['fps'] == None and self.fps != None:
                 run['fps'] = self.fps
-            anim.run(**(run))
+            args = dict(run)
+            for key, default in (('deadline', False), ('overload', OverloadPolicy.NONE)):
+                value = args.pop(key, None)
+                if value == None:
+                    value = getattr(self, key)
+                # only passed when set, so animations that override run()
+                # without these arguments still work
+                if value != default:
+                    args[key] = value
+            anim.run(**(args))
 
     RUN_PARAMS = [{
                 "id": "fps",
@@ -293,6 +557,24 @@ class AnimationQueue(BaseAnimation):
                 "default": None,
                 "min": 1,
                 "help":"Default framerate to run all animations in queue."
+            },{
+                "id": "deadline",
+                "label": "Deadline Timing",
+                "type": "bool",
+                "default": False,
+                "help":"Default for timing all animations in queue against a drift-free monotonic clock."
+            },{
+                "id": "overload",
+                "label": "Default Overload Policy",
+                "type": "combo",
+                "options": {
+                    0: "Slow Down",
+                    1: "Skip Frames",
+                    2: "Drop Updates",
+                    3: "Adaptive Framerate"
+                },
+                "default": 0,
+                "help":"Default for what animations in queue do when frames take longer than the frame time."
             },{
                 "id": "untilComplete",
                 "label": "Until Complete",
@@ -476,6 +758,51 @@ class MatrixCalibrationTest(BaseMatrixAnim):
 
         self._step += 1
 
+class RecordingAnim(BaseAnimation):
+    """
+    Plays back a file written by drivers.recorder.DriverRecorder, copying
+    each frame into the buffer with setBuffer. Frames are timed as they were
+    recorded, sped up by speed, or by the run framerate if useTimestamps is
+    False. Works with any LED class with the same buffer size
+    """
+    def __init__(self, led, path, useTimestamps = True, speed = 1.0):
+        super(RecordingAnim, self).__init__(led)
+        from drivers.recorder import FrameRecording
+        self._recording = FrameRecording(path)
+        # compare buffer sizes, not numLEDs, which for an LEDMatrix with a
+        # pixelSize counts logical pixels
+        if self._recording.bufByteCount != led.bufByteCount:
+            self._recording.close()
+            raise ValueError("Recording frames are {} bytes but the display buffer has {}".format(self._recording.bufByteCount, led.bufByteCount))
+        self._useTimestamps = useTimestamps
+        self._speed = speed
+        self._frame = 0
+
+    def _exit(self, type, value, traceback):
+        self._recording.close()
+
+    def preRun(self, amt=1):
+        super(RecordingAnim, self).preRun(amt)
+        self._frame = 0
+
+    def step(self, amt=1):
+        rec = self._recording
+        if len(rec) == 0:
+            self.animComplete = True
+            return
+
+        data = rec.frame(self._frame)
+        self._led.setBuffer(data if self._led._compactBuffer else list(data))
+
+        next = self._frame + amt
+        if next >= len(rec):
+            next %= len(rec)
+            self.animComplete = True
+        elif self._useTimestamps:
+            self._internalDelay = (rec.timestamp(next) - rec.timestamp(self._frame)) / self._speed
+        self._frame = next
+        self._step += amt
+
 class MasterAnimation(BaseMatrixAnim):
     """
     Takes copies of fake leds, combines using heights and mixing to fill and update
@@ -554,10 +881,10 @@ class MasterAnimation(BaseMatrixAnim):
         self._step += 1
 
 
-    def run(self, amt = 1, fps=None, sleep=None, max_steps = 0, untilComplete = True, max_cycles = 0, threaded = True, joinThread = False, callback=None):
+    def run(self, amt = 1, fps=None, sleep=None, max_steps = 0, untilComplete = True, max_cycles = 0, threaded = True, joinThread = False, callback=None, deadline = False, overload = OverloadPolicy.NONE):
         # self.fps = fps
         # self.untilComplete = untilComplete
-        super(MasterAnimation, self).run(amt = 1, fps=fps, sleep=None, max_steps = max_steps, untilComplete = untilComplete, max_cycles = 0, threaded = threaded, joinThread = joinThread, callback=callback)
+        super(MasterAnimation, self).run(amt = 1, fps=fps, sleep=None, max_steps = max_steps, untilComplete = untilComplete, max_cycles = 0, threaded = threaded, joinThread = joinThread, callback=callback, deadline = deadline, overload = overload)
 #        while not self.animComplete:
 #            pass
 
@@ -0,0 +1,160 @@
+"""
+Headless animation benchmark. Runs an animation against a dummy driver for
+a number of frames without any frame timing and reports its speed as JSON:
+
+    python -m bibliopixel.benchmark mymodule.MyAnim --matrix 32x32 --frames 500
+
+or from Python with benchmark(MyAnim, {"type": "matrix", "width": 32, "height": 32})
+"""
+import sys
+import os
+os.sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gc
+import json
+import math
+import importlib
+
+from led import LEDStrip, LEDMatrix, LEDCircle
+from drivers.dummy_driver import DriverDummy
+from util import monotonic
+
+
+class DriverBenchmark(DriverDummy):
+    """DriverDummy that also converts every frame with _fixData, like real drivers"""
+
+    def update(self, data):
+        self._timedFixData(data)
+
+
+def makeLED(geometry):
+    """
+    Creates an LEDStrip, LEDMatrix or LEDCircle on a DriverBenchmark from a
+    geometry dict with "type" set to "strip" (with "num"), "matrix" (with
+    "width" and "height") or "circle" (with "rings"). Any other keys are
+    passed on to the LED class, e.g. "rotation" or "compactBuffer"
+    """
+    args = dict(geometry)
+    kind = args.pop("type", "matrix")
+    if kind == "strip":
+        return LEDStrip(DriverBenchmark(args.pop("num")), **args)
+    elif kind == "matrix":
+        driver = DriverBenchmark(args["width"] * args["height"])
+        return LEDMatrix(driver, **args)
+    elif kind == "circle":
+        rings = args.pop("rings")
+        num = sum(len(r) if len(r) > 2 else r[1] - r[0] + 1 for r in rings)
+        return LEDCircle(DriverBenchmark(num), rings, **args)
+    raise ValueError("Unknown geometry type: {}".format(kind))
+
+def _stats(values):
+    values = sorted(values)
+    n = len(values)
+    if n == 0:
+        return {"total": 0.0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+    def pct(p):
+        return values[min(n - 1, max(0, int(math.ceil(p / 100.0 * n)) - 1))]
+    total = sum(values)
+    return {"total": total, "mean": total / n, "p50": pct(50), "p95": pct(95), "p99": pct(99)}
+
+def benchmark(animClass, geometry, frames = 300, warmup = 10, amt = 1, animArgs = None):
+    """
+    Runs frames frames, after warmup untimed ones, of animClass(led, **animArgs)
+    on makeLED(geometry) as fast as possible and returns a dict of frames/s,
+    per-stage times in ms (step, update and the fixData part of update).
+    The garbage collector is disabled while timing so collections don't
+    land on random frames. Allocations are not measured, as Python 2 has
+    no allocation counter: its gc counts are net of frees
+    """
+    led = makeLED(geometry)
+    anim = animClass(led, **(animArgs or {}))
+    driver = led.driver[0]
+
+    anim.preRun()
+
+    def frame():
+        anim.preStep(amt)
+        anim.step(amt)
+        anim.postStep(amt)
+        mid = monotonic()
+        led.update()
+        return mid
+
+    for i in range(warmup):
+        frame()
+
+    step = []
+    update = []
+    fix = []
+
+    gcWasEnabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        start = monotonic()
+        for i in range(frames):
+            frameStart = monotonic()
+            mid = frame()
+            end = monotonic()
+            step.append((mid - frameStart) * 1000.0)
+            update.append((end - mid) * 1000.0)
+            fix.append(driver.lastFixTime)
+        elapsed = monotonic() - start
+    finally:
+        if gcWasEnabled:
+            gc.enable()
+
+    anim.postRun()
+
+    return {
+        "animation": "{}.{}".format(animClass.__module__, animClass.__name__),
+        "geometry": geometry,
+        "frames": frames,
+        "seconds": elapsed,
+        "fps": frames / elapsed if elapsed > 0 else 0.0,
+        "step": _stats(step),
+        "update": _stats(update),
+        "fixData": _stats(fix),
+        "python": sys.version.split()[0]
+    }
+
+def _loadClass(path):
+    module, name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module), name)
+
+def main(argv = None):
+    import argparse
+    parser = argparse.ArgumentParser(description = "Benchmark an animation without a display")
+    parser.add_argument("animation", help = "animation class as module.Class")
+    group = parser.add_mutually_exclusive_group(required = True)
+    group.add_argument("--strip", type = int, metavar = "NUM", help = "LEDStrip of NUM LEDs")
+    group.add_argument("--matrix", metavar = "WxH", help = "LEDMatrix of W by H LEDs")
+    group.add_argument("--circle", metavar = "JSON", help = "LEDCircle rings as JSON, e.g. [[0, 23], [24, 39]]")
+    parser.add_argument("--led-args", default = "{}", metavar = "JSON", help = "extra LED class arguments as JSON")
+    parser.add_argument("--anim-args", default = "{}", metavar = "JSON", help = "animation arguments as JSON")
+    parser.add_argument("--frames", type = int, default = 300)
+    parser.add_argument("--warmup", type = int, default = 10)
+    parser.add_argument("--amt", type = int, default = 1)
+    parser.add_argument("--output", help = "write the JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.strip:
+        geometry = {"type": "strip", "num": args.strip}
+    elif args.matrix:
+        w, h = args.matrix.lower().split("x")
+        geometry = {"type": "matrix", "width": int(w), "height": int(h)}
+    else:
+        geometry = {"type": "circle", "rings": json.loads(args.circle)}
+    geometry.update(json.loads(args.led_args))
+
+    result = benchmark(_loadClass(args.animation), geometry, args.frames, args.warmup,
+        args.amt, json.loads(args.anim_args))
+
+    out = json.dumps(result, indent = 2, sort_keys = True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+if __name__ == "__main__":
+    main()
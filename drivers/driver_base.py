@@ -34,6 +34,10 @@ class DriverBase(object):
 
         self._thread = None
         self.lastUpdate = 0
+        # ms the last _fixData took, see _timedFixData
+        self.lastFixTime = 0
+        # set by LEDBase when using a commit barrier, see commit()
+        self.deferCommit = False
 
     def __enter__(self):
         return self
@@ -55,6 +59,22 @@ class DriverBase(object):
     def setMasterBrightness(self, brightness):
         return False
 
+    #Show data previously pushed by update()
+    def commit(self):
+        """Called after every driver has been updated when LEDBase uses a commit barrier.
+        Drivers that can hold a frame until told to display it should skip that
+        step in update() while self.deferCommit is set and do it here instead.
+        Others, which includes every driver in this package, show each frame
+        in update() and ignore this.
+        """
+        pass
+
+    def _timedFixData(self, data):
+        """Calls _fixData, keeping how long it took in lastFixTime"""
+        start = time.time()
+        self._fixData(data)
+        self.lastFixTime = (time.time() - start) * 1000.0
+
     def _fixData(self, data):
         gamma = self.gamma
         for a, b in enumerate(self.c_order):
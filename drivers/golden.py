@@ -0,0 +1,112 @@
+from driver_base import *
+import os, sys
+import json
+import zlib
+os.sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import log
+
+HASHES = {
+    "crc32": zlib.crc32,
+    "adler32": zlib.adler32
+}
+
+
+class DriverGolden(DriverBase):
+    """
+    Hashes every frame it is sent and compares the sequence against a golden
+    list of hashes, to prove a deterministic animation still draws exactly
+    the same frames, e.g. after optimizing it. Without a golden list the
+    hashes are only collected, to be written with save().
+    golden - list of frame hashes, or the path of a file written by save()
+    reference - path of a drivers.recorder.DriverRecorder recording of the
+        golden frames, used to show which pixels differ in the first frame
+        that does not match
+    hash - "crc32" or "adler32", ignored if golden is a file
+    """
+
+    def __init__(self, num, golden = None, reference = None, hash = "crc32", maxDiff = 20):
+        super(DriverGolden, self).__init__(num)
+        if isinstance(golden, basestring):
+            with open(golden) as f:
+                saved = json.load(f)
+            hash = saved["hash"]
+            golden = saved["frames"]
+            if saved["numLEDs"] != self.numLEDs:
+                raise ValueError("Golden frames are of {} LEDs, not {}".format(saved["numLEDs"], self.numLEDs))
+        if hash not in HASHES:
+            raise ValueError("Unknown hash: {}".format(hash))
+
+        self.hash = hash
+        self._hashFunc = HASHES[hash]
+        self.golden = golden
+        self.reference = reference
+        self.maxDiff = maxDiff
+        self.hashes = []
+        self.firstDivergence = None
+        self.divergentFrame = None
+        self.pixelDiff = None
+        self.diffCount = 0
+
+    #Push new data to strand
+    def update(self, data):
+        data = data if isinstance(data, bytearray) else bytearray(data)
+        i = len(self.hashes)
+        h = self._hashFunc(bytes(data)) & 0xFFFFFFFF
+        self.hashes.append(h)
+
+        if self.golden is None or self.firstDivergence is not None:
+            return
+        if i >= len(self.golden) or self.golden[i] != h:
+            self.firstDivergence = i
+            # a copy, data may be the LED buffer itself
+            self.divergentFrame = bytearray(data)
+            self._diff(i, data)
+            log.logger.error(self.report())
+
+    def _diff(self, i, data):
+        if not self.reference:
+            return
+        from recorder import FrameRecording
+        with FrameRecording(self.reference) as ref:
+            if i >= len(ref):
+                return
+            expected = ref.frame(i)
+        self.pixelDiff = []
+        self.diffCount = 0
+        for p in range(self.numLEDs):
+            e = expected[p * 3:p * 3 + 3]
+            a = data[p * 3:p * 3 + 3]
+            if e != a:
+                self.diffCount += 1
+                if len(self.pixelDiff) < self.maxDiff:
+                    self.pixelDiff.append((p, tuple(e), tuple(a)))
+
+    def matches(self):
+        """True if every golden frame has been received and all of them matched"""
+        return (self.golden is not None and self.firstDivergence is None and
+            len(self.hashes) == len(self.golden))
+
+    def report(self):
+        """Describes how the frames received so far compare to the golden ones"""
+        if self.golden is None:
+            return "Recorded {} frame hashes, no golden frames to compare to".format(len(self.hashes))
+        if self.firstDivergence is None:
+            if len(self.hashes) < len(self.golden):
+                return "First {} frames match but {} golden frames were expected".format(len(self.hashes), len(self.golden))
+            return "All {} frames match".format(len(self.hashes))
+
+        i = self.firstDivergence
+        if i >= len(self.golden):
+            return "Frame {} received, but only {} golden frames".format(i, len(self.golden))
+        lines = ["Frame {} differs: hash {:08x}, expected {:08x}".format(i, self.hashes[i], self.golden[i])]
+        if self.pixelDiff is not None:
+            lines.append("{} pixel(s) differ{}".format(self.diffCount,
+                ", first {}:".format(len(self.pixelDiff)) if self.diffCount > len(self.pixelDiff) else ":"))
+            for p, e, a in self.pixelDiff:
+                lines.append("  pixel {}: expected {}, got {}".format(p, e, a))
+        return "\n".join(lines)
+
+    def save(self, path):
+        """Writes the hashes received so far to path, to use as golden frames later"""
+        with open(path, "w") as f:
+            json.dump({"hash": self.hash, "numLEDs": self.numLEDs, "frames": self.hashes}, f)
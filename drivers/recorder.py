@@ -0,0 +1,122 @@
+from driver_base import *
+import os, sys
+import mmap
+import struct
+os.sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import log
+from util import monotonic
+
+# File layout: a header of magic, format version and LED count, then one
+# record per frame of an 8 byte timestamp, in ms since the first frame,
+# followed by the raw r,g,b values of every LED. All little endian
+MAGIC = "BPRF"
+VERSION = 1
+HEADER = struct.Struct("<4sBxxxI")
+TIMESTAMP = struct.Struct("<d")
+
+
+class DriverRecorder(DriverBase):
+    """
+    Records every frame, as sent to LEDBase.update, to a compact binary file
+    along with when it was sent. Play it back with FrameRecording or
+    animation.RecordingAnim
+    """
+
+    def __init__(self, num, path):
+        super(DriverRecorder, self).__init__(num)
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION, self.numLEDs))
+        self._start = None
+        self.frames = 0
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def writeFrame(self, data, timestamp):
+        """Appends data as a frame at timestamp ms, for frames not sent in real time"""
+        if len(data) != self.bufByteCount:
+            error = "Frame has {} bytes but the recording is of {}".format(len(data), self.bufByteCount)
+            log.logger.error(error)
+            raise ValueError(error)
+        self._file.write(TIMESTAMP.pack(timestamp))
+        self._file.write(data if isinstance(data, bytearray) else bytearray(data))
+        self.frames += 1
+
+    #Push new data to strand
+    def update(self, data):
+        now = monotonic() * 1000.0
+        if self._start is None:
+            self._start = now
+        self.writeFrame(data, now - self._start)
+
+
+class FrameRecording(object):
+    """
+    Memory-mapped reader of a file written by DriverRecorder. Frames are
+    only read from the file as they are asked for
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        header = self._file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError("{} is not a frame recording".format(path))
+        magic, version, self.numLEDs = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("{} is not a frame recording".format(path))
+        if version != VERSION:
+            raise ValueError("Unsupported frame recording version {}".format(version))
+
+        self.bufByteCount = self.numLEDs * 3
+        self._recordSize = TIMESTAMP.size + self.bufByteCount
+        size = os.path.getsize(path)
+        # a frame cut short by an interrupted recording is ignored
+        self.frameCount = (size - HEADER.size) / self._recordSize
+        self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ) if size else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return self.frameCount
+
+    def _offset(self, i):
+        if i < 0:
+            i += self.frameCount
+        if i < 0 or i >= self.frameCount:
+            raise IndexError("frame index out of range")
+        return HEADER.size + i * self._recordSize
+
+    def timestamp(self, i):
+        """ms from the first frame to frame i"""
+        pos = self._offset(i)
+        return TIMESTAMP.unpack(self._map[pos:pos + TIMESTAMP.size])[0]
+
+    def frame(self, i):
+        """Returns the r,g,b values of frame i as a bytearray, ready for setBuffer"""
+        pos = self._offset(i) + TIMESTAMP.size
+        return bytearray(self._map[pos:pos + self.bufByteCount])
+
+    def duration(self):
+        """ms from the first frame to the last"""
+        if self.frameCount == 0:
+            return 0.0
+        return self.timestamp(-1)
@@ -300,18 +300,20 @@ class DriverSerial(DriverBase):
         else:
             return True
 
-    #Push new data to strand
-    def update(self, data):
+    def _buildPacket(self, data):
+        """Returns the PIXEL_DATA packet that sends data to the controller"""
         count = self.bufByteCount + self._bufPad
         packet = DriverSerial._generateHeader(CMDTYPE.PIXEL_DATA, count)
 
-        c_order = self.c_order
-
-        self._fixData(data)
+        self._timedFixData(data)
 
         packet.extend(self._buf)
         packet.extend([0]*self._bufPad)
-        self._com.write(packet)
+        return packet
+
+    #Push new data to strand
+    def update(self, data):
+        self._com.write(self._buildPacket(data))
 
         resp = self._com.read(1)
         if len(resp) == 0:
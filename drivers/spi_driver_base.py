@@ -82,7 +82,7 @@ class DriverSPIBase(DriverBase):
             self.spi.flush()
 
     def update(self, data):
-        self._fixData(data)
+        self._timedFixData(data)
         self._sendData()
         
 
@@ -10,106 +10,468 @@ except ImportError as e:
     log.logger.error(error)
     raise ImportError(error)
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import glob
-from led import LEDMatrix
+import mmap
+import threading
+from led import LEDMatrix, _scaleTable
+from animation import BaseMatrixAnim
+from util import LRUCache, workerPool
 import colors
 
 
-def showImage(led, imagePath = "", imageObj = None, offset = (0,0), bgcolor = colors.Off, brightness = 255):
-    """Display an image on the matrix"""
-
-    if not isinstance(led, LEDMatrix):
-        raise RuntimeError("Must use LEDMatrix with showImage!")
-
-
-    bgcolor = colors.color_scale(bgcolor, brightness)
-
+def _openImage(imagePath, imageObj):
     img = imageObj
     if not img and not (imagePath == ""):
         img = Image.open(imagePath)
     elif not img:
         raise ValueError("Must provide either imagePath or imageObj")
+    return img
 
-    w = led.width - offset[0]
+def _imageRGB(img, bgcolor, brightness):
+    """
+    Converts img to a bytearray of r,g,b values in row order, with each color
+    scaled by its alpha, fully transparent pixels set to bgcolor and the
+    result scaled by brightness
+    """
+    rgba = img.convert('RGBA').tobytes()
+
+    if numpy is not None:
+        w, h = img.size
+        a = numpy.frombuffer(rgba, dtype=numpy.uint8).reshape(h, w, 4).astype(numpy.uint16)
+        rgb = (a[:, :, :3] * a[:, :, 3:]) >> 8
+        rgb[a[:, :, 3] == 0] = bgcolor
+        if brightness != 255:
+            rgb = (rgb * brightness) >> 8
+        return bytearray(rgb.astype(numpy.uint8).tostring())
+
+    rgba = bytearray(rgba)
+    alpha = rgba[3::4]
+    data = bytearray(len(alpha) * 3)
+    data[0::3] = rgba[0::4]
+    data[1::3] = rgba[1::4]
+    data[2::3] = rgba[2::4]
+
+    if alpha.count(alpha[0:1]) == len(alpha):
+        # the same alpha everywhere, so the whole image scales by one table
+        if alpha[0] == 0:
+            data = bytearray(bgcolor) * len(alpha)
+        else:
+            data = data.translate(_scaleTable(alpha[0])[1])
+    else:
+        bg = bytearray(bgcolor)
+        for p, a in enumerate(alpha):
+            i = p * 3
+            if a == 0:
+                data[i:i + 3] = bg
+            else:
+                table = _scaleTable(a)[0]
+                data[i] = table[data[i]]
+                data[i + 1] = table[data[i + 1]]
+                data[i + 2] = table[data[i + 2]]
+
+    if brightness != 255:
+        data = data.translate(_scaleTable(brightness)[1])
+    return data
+
+def _imageRegion(led, img, offset):
+    """
+    returns (box, x, y), the part of img that lands on the matrix when drawn
+    at offset as a PIL crop box and the matrix position of its top-left, or
+    None if none of it does
+    """
+    ox, oy = offset
+
+    w = led.width - ox
     if img.size[0] < w:
         w = img.size[0]
 
-    h = led.height - offset[1]
+    h = led.height - oy
     if img.size[1] < h:
         h = img.size[1]
 
-    ox = offset[0]
-    oy = offset[1]
+    x0 = max(0, -ox)
+    y0 = max(0, -oy)
+    if w <= x0 or h <= y0:
+        return None
+    return (x0, y0, w, h), ox + x0, oy + y0
+
+def showImage(led, imagePath = "", imageObj = None, offset = (0,0), bgcolor = colors.Off, brightness = 255):
+    """Display an image on the matrix. Any PIL image mode is converted to RGBA"""
+
+    if not isinstance(led, LEDMatrix):
+        raise RuntimeError("Must use LEDMatrix with showImage!")
+
+
+    bgcolor = colors.color_scale(bgcolor, brightness)
+
+    img = _openImage(imagePath, imageObj)
 
     led.all_off()
 
-    for x in range(ox, w + ox):
-        for y in range(oy, h + oy):
-            r,g,b,a = (0,0,0,255)
-            rgba = img.getpixel((x - ox,y - oy))
+    region = _imageRegion(led, img, offset)
+    if region is None:
+        return
+    box, x, y = region
 
-            if isinstance(rgba, int):
-                raise ValueError("Image must be in RGB or RGBA format!");
-            if len(rgba) == 3: r,g,b = rgba
-            elif len(rgba) == 4: r,g,b,a = rgba
-            else: raise ValueError("Image must be in RGB or RGBA format!");
+    data = _imageRGB(img.crop(box), bgcolor, brightness)
+    stride = (box[2] - box[0]) * 3
+    for row in range(box[3] - box[1]):
+        led._setRow(x, y + row, data[row * stride:(row + 1) * stride])
 
-            if a == 0:
-                r, g, b = bgcolor
-            else:
-                r, g, b = colors.color_scale((r, g, b), a)
+def loadTexture(led, imagePath = "", imageObj = None, offset = (0,0), bgcolor = colors.Off, brightness = 255):
+    """
+    Load an image as a flat texture for led.setTexture, a bytearray of
+    led.width * led.height r,g,b values in row order. Pixels outside the
+    image are Off
+    """
 
-            if brightness != 255:
-                r, g, b = colors.color_scale((r, g, b), brightness)
+    if not isinstance(led, LEDMatrix):
+        raise RuntimeError("Must use LEDMatrix with loadTexture!")
+
+
+    bgcolor = colors.color_scale(bgcolor, brightness)
+
+    img = _openImage(imagePath, imageObj)
 
-            led.set(x, y, (r, g, b))
+    texture = bytearray(led.width * led.height * 3)
+
+    region = _imageRegion(led, img, offset)
+    if region is None:
+        return texture
+    box, x, y = region
+
+    data = _imageRGB(img.crop(box), bgcolor, brightness)
+    stride = (box[2] - box[0]) * 3
+    for row in range(box[3] - box[1]):
+        i = ((y + row) * led.width + x) * 3
+        texture[i:i + stride] = data[row * stride:(row + 1) * stride]
+
+    return texture
 
 def loadImage(led, imagePath = "", imageObj = None, offset = (0,0), bgcolor = colors.Off, brightness = 255):
-    """Display an image on the matrix"""
+    """
+    Load an image as a texture for led.setTexture, a list of led.height rows
+    of led.width RGB tuples. See loadTexture for a more compact version
+    """
 
     if not isinstance(led, LEDMatrix):
         raise RuntimeError("Must use LEDMatrix with loadImage!")
 
+    data = loadTexture(led, imagePath, imageObj, offset, bgcolor, brightness)
+    pixels = zip(data[0::3], data[1::3], data[2::3])
+    w = led.width
+    return [pixels[y * w:(y + 1) * w] for y in range(led.height)]
 
-    bgcolor = colors.color_scale(bgcolor, brightness)
 
-    img = imageObj
-    if not img and not (imagePath == ""):
-        img = Image.open(imagePath)
-    elif not img:
-        raise ValueError("Must provide either imagePath or imageObj")
+class FrameCache(object):
+    """
+    Holds decoded frames, as byte strings, by key. Up to maxBytes are kept
+    in memory, dropping the least recently used beyond that. If spillPath is
+    given every frame is also appended to that file, which is memory-mapped
+    to reload frames dropped from memory, and indexed in spillPath + ".idx"
+    so that it can be reused by later runs. Frame counts of images are kept
+    apart from the frames, and also saved in the index
+    """
+    def __init__(self, maxBytes=64 * 1024 * 1024, spillPath=None):
+        self._frames = LRUCache(maxBytes, sizeOf=len)
+        self._counts = {}
+        self._spillPath = spillPath
+        self._spill = None
+        self._index = None
+        self._map = None
+        self._lock = threading.Lock()
+        if spillPath:
+            self._openSpill()
 
-    w = led.width - offset[0]
-    if img.size[0] < w:
-        w = img.size[0]
+    def _openSpill(self):
+        self._index = {}
+        end = 0
+        if os.path.exists(self._spillPath) and os.path.exists(self._spillPath + ".idx"):
+            size = os.path.getsize(self._spillPath)
+            with open(self._spillPath + ".idx", "r") as f:
+                for line in f:
+                    try:
+                        start, length, key = line.rstrip("\n").split(" ", 2)
+                        if start == "count":
+                            self._counts[key] = int(length)
+                            continue
+                        start, length = int(start), int(length)
+                    except ValueError:
+                        continue
+                    # skip anything cut short by an interrupted write
+                    if start + length <= size:
+                        self._index[key] = (start, length)
+                        end = max(end, start + length)
 
-    h = led.height - offset[1]
-    if img.size[1] < h:
-        h = img.size[1]
+        self._spill = open(self._spillPath, "r+b" if os.path.exists(self._spillPath) else "w+b")
+        self._spill.truncate(end)
+        with open(self._spillPath + ".idx", "w") as f:
+            for key, (start, length) in self._index.items():
+                f.write("{} {} {}\n".format(start, length, key))
+            for key, count in self._counts.items():
+                f.write("count {} {}\n".format(count, key))
 
-    ox = offset[0]
-    oy = offset[1]
+    def __contains__(self, key):
+        return key in self._frames or (self._index is not None and key in self._index)
 
-    texture = [[colors.Off for x in range(led.width)] for y in range(led.height)]
-    for x in range(ox, w + ox):
-        for y in range(oy, h + oy):
-            r,g,b,a = (0,0,0,255)
-            rgba = img.getpixel((x - ox,y - oy))
-            if isinstance(rgba, int):
-                raise ValueError("Image must be in RGB or RGBA format!");
-            if len(rgba) == 3: r,g,b = rgba
-            elif len(rgba) == 4: r,g,b,a = rgba
-            else: raise ValueError("Image must be in RGB or RGBA format!");
+    def get(self, key):
+        """Returns the frame stored as key or None"""
+        data = self._frames.get(key)
+        if data is None and self._index is not None:
+            with self._lock:
+                if key not in self._index:
+                    return None
+                start, length = self._index[key]
+                if self._map is None or len(self._map) < start + length:
+                    if self._map is not None:
+                        self._map.close()
+                    self._spill.flush()
+                    self._map = mmap.mmap(self._spill.fileno(), 0, access=mmap.ACCESS_READ)
+                data = bytearray(self._map[start:start + length])
+            self._frames.put(key, data)
+        return data
 
-            if a == 0:
-                r, g, b = bgcolor
+    def put(self, key, data):
+        data = bytearray(data)
+        self._frames.put(key, data)
+        if self._index is not None:
+            with self._lock:
+                if key in self._index:
+                    return
+                self._spill.seek(0, 2)
+                start = self._spill.tell()
+                self._spill.write(data)
+                self._spill.flush()
+                with open(self._spillPath + ".idx", "a") as f:
+                    f.write("{} {} {}\n".format(start, len(data), key))
+                self._index[key] = (start, len(data))
+
+    def getCount(self, key):
+        """Returns the frame count stored as key or None"""
+        return self._counts.get(key)
+
+    def putCount(self, key, count):
+        self._counts[key] = count
+        if self._index is not None:
+            with self._lock:
+                with open(self._spillPath + ".idx", "a") as f:
+                    f.write("count {} {}\n".format(count, key))
+
+    def clear(self):
+        """Drops all frames from memory. The spill file is left as is"""
+        self._frames.clear()
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+                self._index = None
+
+
+class ImageAnim(BaseMatrixAnim):
+    """
+    Plays an animated image, such as a GIF, or a folder of images in name
+    order at the run framerate. Frames are decoded once, resized to the
+    matrix if resize is True, and kept packed in a FrameCache, so after the
+    first loop each frame is only copied into the buffer. Pass the same
+    cache to several ImageAnims to share its memory budget or spill file
+    """
+    def __init__(self, led, imagePath, offset = (0,0), bgcolor = colors.Off, brightness = 255, resize = True, cache = None):
+        super(ImageAnim, self).__init__(led)
+        self.imagePath = os.path.abspath(imagePath)
+        self._offset = tuple(offset)
+        self._bgcolor = tuple(bgcolor)
+        self._brightness = brightness
+        self._resize = resize
+        self._cache = cache if cache is not None else FrameCache()
+        self._img = None
+        self._decodeLock = threading.Lock()
+        self._frame = 0
+
+        self._params = "{}x{}:{}:{}:{}:{}".format(led.width, led.height, self._offset,
+            self._bgcolor, brightness, int(resize))
+
+        if os.path.isdir(self.imagePath):
+            self._files = sorted(f for f in glob.glob(os.path.join(self.imagePath, "*"))
+                if os.path.splitext(f)[1].lower() in (".png", ".gif", ".jpg", ".jpeg", ".bmp"))
+            if not self._files:
+                raise ValueError("No images found in {}".format(imagePath))
+            self.frameCount = len(self._files)
+        else:
+            self._files = None
+            key = self._sourceKey(self.imagePath)
+            count = self._cache.getCount(key)
+            if count is None:
+                count = self._countFrames()
+                self._cache.putCount(key, count)
+            self.frameCount = count
+
+    def _sourceKey(self, path):
+        return "{}:{}".format(path, os.path.getmtime(path))
+
+    def _frameKey(self, i):
+        if self._files is not None:
+            return "{}:0:{}".format(self._sourceKey(self._files[i]), self._params)
+        return "{}:{}:{}".format(self._sourceKey(self.imagePath), i, self._params)
+
+    def _countFrames(self):
+        img = Image.open(self.imagePath)
+        count = getattr(img, "n_frames", None)
+        if count is None:
+            count = 0
+            for f in ImageSequence.Iterator(img):
+                count += 1
+        return count
+
+    def _decode(self, i):
+        """Decodes frame i into a full matrix texture"""
+        with self._decodeLock:
+            if self._files is not None:
+                img = Image.open(self._files[i])
             else:
-                r, g, b = colors.color_scale((r, g, b), a)
+                # frames decode incrementally when seeking forward
+                if self._img is None or self._img.tell() > i:
+                    self._img = Image.open(self.imagePath)
+                self._img.seek(i)
+                img = self._img
+            img = img.convert("RGBA")
 
-            if brightness != 255:
-                r, g, b = colors.color_scale((r, g, b), brightness)
+        if self._resize and img.size != (self._led.width, self._led.height):
+            img = img.resize((self._led.width, self._led.height), Image.ANTIALIAS)
+        return loadTexture(self._led, imageObj = img, offset = self._offset,
+            bgcolor = self._bgcolor, brightness = self._brightness)
 
-            if y>=0 and x>=0:
-                texture[y][x] = (r, g, b)
+    def ready(self):
+        """True if every frame is cached, so playing will not decode anything"""
+        return all(self._frameKey(i) in self._cache for i in range(self.frameCount))
 
-    return texture
+    def getFrame(self, i):
+        """Returns frame i as a texture, decoding it if not already cached"""
+        key = self._frameKey(i)
+        data = self._cache.get(key)
+        if data is None:
+            data = self._decode(i)
+            self._cache.put(key, data)
+        return data
+
+    def preRun(self, amt=1):
+        super(ImageAnim, self).preRun(amt)
+        self._frame = 0
+
+    def step(self, amt=1):
+        data = self.getFrame(self._frame)
+        stride = self._led.width * 3
+        for y in range(self._led.height):
+            self._led._setRow(0, y, data[y * stride:(y + 1) * stride])
+
+        self._frame += amt
+        if self._frame >= self.frameCount:
+            self._frame %= self.frameCount
+            self.animComplete = True
+        self._step += amt
+
+
+class ImagePlaylist(BaseMatrixAnim):
+    """
+    Plays a list of animated images or image folders in turn, each for loops
+    full loops. The next prefetch items, at least one, are loaded into the cache on a pool
+    of background workers while the current one plays. If the next item is
+    not ready yet the current one keeps looping rather than waiting on it,
+    so the cache should be able to hold prefetch + 1 items
+    """
+    def __init__(self, led, imagePaths, loops = 1, prefetch = 2, workers = 1, offset = (0,0), bgcolor = colors.Off, brightness = 255, resize = True, cache = None):
+        super(ImagePlaylist, self).__init__(led)
+        if not imagePaths:
+            raise ValueError("Must provide at least one image.")
+        self.imagePaths = list(imagePaths)
+        self._loops = max(1, loops)
+        # the next item must always be loading or the playlist never moves on
+        self._prefetch = max(1, prefetch)
+        self._workers = workers
+        self._animArgs = {
+            "offset": offset,
+            "bgcolor": bgcolor,
+            "brightness": brightness,
+            "resize": resize,
+            "cache": cache if cache is not None else FrameCache()
+        }
+        self._pool = None
+        self._jobs = {}
+        self.curAnim = None
+        self.index = 0
+        self._loopCount = 0
+
+    def _load(self, path):
+        anim = ImageAnim(self._led, path, **self._animArgs)
+        for i in range(anim.frameCount):
+            anim.getFrame(i)
+        return anim
+
+    def _schedule(self):
+        """Makes sure the current and the next prefetch items are being loaded"""
+        count = len(self.imagePaths)
+        window = set((self.index + i) % count for i in range(min(self._prefetch + 1, count)))
+        for i in self._jobs.keys():
+            if i not in window:
+                del self._jobs[i]
+        for i in window:
+            if i not in self._jobs:
+                self._jobs[i] = self._pool.submit(self._load, self.imagePaths[i])
+
+    def ready(self):
+        """True if the next item has been loaded and can be switched to without waiting"""
+        job = self._jobs.get((self.index + 1) % len(self.imagePaths))
+        return job is not None and job.done()
+
+    def _next(self):
+        job = self._jobs[(self.index + 1) % len(self.imagePaths)]
+        self.index = (self.index + 1) % len(self.imagePaths)
+        self._loopCount = 0
+        if job.error is not None:
+            log.logger.error("Unable to load {}: {}".format(self.imagePaths[self.index], job.error))
+        else:
+            self.curAnim = job.result
+            self.curAnim.preRun()
+        self._schedule()
+        if self.index == 0:
+            self.animComplete = True
+
+    def preRun(self, amt=1):
+        super(ImagePlaylist, self).preRun(amt)
+        if self._pool is None:
+            self._pool = workerPool(self._workers)
+        self.index = 0
+        self._loopCount = 0
+        self._jobs = {}
+        self._schedule()
+        self.curAnim = self._jobs[0].wait()
+        self.curAnim.preRun()
+
+    def postRun(self):
+        super(ImagePlaylist, self).postRun()
+        if self._pool is not None:
+            self._pool.stop()
+            self._pool = None
+
+    def step(self, amt=1):
+        if self.curAnim is not None:
+            self.curAnim.animComplete = False
+            self.curAnim.step(amt)
+            if self.curAnim.animComplete:
+                self._loopCount += 1
+
+        if self.curAnim is None or self._loopCount >= self._loops:
+            if self.ready():
+                self._next()
+            elif self.curAnim is not None:
+                log.logger.debug("Next image not loaded yet, repeating {}".format(self.imagePaths[self.index]))
+        self._step += amt
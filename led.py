@@ -4,51 +4,275 @@ import time
 import math
 import font
 import threading
+import collections
+import itertools
+import array
+import log
+from util import workerPool, LRUCache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # bulk pixel operations fall back to plain Python
+
+
+_scaleTables = {}
+
+def _scaleTable(level):
+    """
+    returns (table, bytes) where table[v] == (v * level) >> 8 for v in 0 - 255
+    and bytes is the same table as a str for bytearray.translate.
+    Cached, as there are only 256 levels
+    """
+    try:
+        return _scaleTables[level]
+    except KeyError:
+        table = [(v * level) >> 8 for v in range(256)]
+        _scaleTables[level] = (table, str(bytearray(table)))
+        return _scaleTables[level]
+
+
+def _requireNumpy():
+    if numpy is None:
+        error = "Please install NumPy: pip install numpy"
+        log.logger.error(error)
+        raise ImportError(error)
+
+
+def _isColor(c):
+    """True if c is a single color tuple rather than a sequence of colors"""
+    try:
+        c[0][0]
+        return False
+    except (TypeError, IndexError):
+        return True
+
+
+_glyphCache = LRUCache(512)
+
+def _glyphSpans(c, size):
+    """
+    returns (fg, bg), lists of (dx, dy, length) horizontal spans covering the
+    set and unset pixels of character code c drawn at size, including the
+    spacing column. size <= 0 uses TINYFONT. Cached in _glyphCache as they are
+    the same for every color
+    """
+    if size <= 0:
+        size = 0
+    key = (c, size)
+    spans = _glyphCache.get(key)
+    if spans is None:
+        if size > 0:
+            FONT = font.GLCDFONT
+            fw, fh = 6, 8
+            scale = size
+        else:
+            FONT = font.TINYFONT
+            fw, fh = 4, 6
+            scale = 1
+
+        cols = [FONT[c][i] for i in range(fw - 1)] + [0]
+        fg = []
+        bg = []
+        for j in range(fh):
+            bits = [(line >> j) & 0x1 for line in cols]
+            i = 0
+            while i < fw:
+                start = i
+                while i < fw and bits[i] == bits[start]:
+                    i += 1
+                target = fg if bits[start] else bg
+                for r in range(scale):
+                    target.append((start * scale, j * scale + r, (i - start) * scale))
+        spans = (fg, bg)
+        _glyphCache.put(key, spans)
+    return spans
+
+
+class UpdatePolicy:
+    BLOCK = 0        #wait for every driver to finish sending the previous frame
+    DROP_OLDEST = 1  #queue frames, dropping the oldest waiting frame when the queue is full
+    LATEST_WINS = 2  #replace any frame still waiting with the newest one
 
 
 class updateThread(threading.Thread):
 
-    def __init__(self, driver):
+    def __init__(self, driver, policy=UpdatePolicy.BLOCK, queueSize=1):
         super(updateThread, self).__init__()
         self.setDaemon(True)
         self._stop = threading.Event()
-        self._wait = threading.Event()  # set when ready and sending data to update driver
-        self._reading = threading.Event()  # set when ready and during read data via setData
-        self._reading.set()
-        self._data = []
+        self._cond = threading.Condition()  # guards _frames and _sending
+        self._frames = collections.deque()  # frames waiting to be sent
+        self._sending = False
         self._driver = driver
+        self.policy = policy
+        self.queueSize = max(1, queueSize)
+        self.sentFrames = 0
+        self.droppedFrames = 0
 
     def setData(self, data):
-        self._reading.wait()
-        self._data = data
-        self._reading.clear()
-        self._wait.set()
+        with self._cond:
+            if self.policy == UpdatePolicy.BLOCK:
+                while (self._sending or self._frames) and not self.stopped():
+                    self._cond.wait()
+            elif self.policy == UpdatePolicy.LATEST_WINS:
+                self.droppedFrames += len(self._frames)
+                self._frames.clear()
+            else:
+                while len(self._frames) >= self.queueSize:
+                    self._frames.popleft()
+                    self.droppedFrames += 1
+            self._frames.append(data)
+            self._cond.notify_all()
 
     def stop(self):
-        self._stop.set()
-        self._wait.set()
+        with self._cond:
+            self._stop.set()
+            self._cond.notify_all()
 
     def stopped(self):
         return self._stop.isSet()
 
     def sending(self):
-        return self._wait.isSet()
+        with self._cond:
+            return self._sending or len(self._frames) > 0
+
+    def waitIdle(self):
+        """Block until every queued frame has been sent"""
+        with self._cond:
+            while (self._sending or self._frames) and not self.stopped():
+                self._cond.wait()
 
     def run(self):
         while True:
-            self._wait.wait()
-            if self.stopped():
-                break
-            self._driver._update(self._data)
-            self._data = []
-            self._wait.clear()
-            self._reading.set()
+            with self._cond:
+                while not self._frames and not self.stopped():
+                    self._cond.wait()
+                if self.stopped():
+                    break
+                data = self._frames.popleft()
+                self._sending = True
+            try:
+                self._driver._update(data)
+            finally:
+                with self._cond:
+                    self._sending = False
+                    self.sentFrames += 1
+                    self._cond.notify_all()
+
+
+class pipelineThread(threading.Thread):
+    """
+    Second stage of a pipelined LEDBase: sends each frame handed to it by
+    send() while the next one is drawn, keeping timings of both stages
+    """
+
+    def __init__(self, led):
+        super(pipelineThread, self).__init__()
+        self.setDaemon(True)
+        self._led = led
+        self._stop = threading.Event()
+        self._cond = threading.Condition()  # guards _frame
+        self._frame = None
+        self.error = None  # raised by the last send, until waitIdle re-raises it
+        self.frames = 0
+        self.sent = 0
+        self.lastRender = 0
+        self.lastStall = 0
+        self.lastSwap = 0
+        self.lastSend = 0
+        self.totalRender = 0
+        self.totalStall = 0
+        self.totalSwap = 0
+        self.totalSend = 0
+
+    def send(self, driverData):
+        with self._cond:
+            self._frame = driverData
+            self._cond.notify_all()
+
+    def stop(self):
+        with self._cond:
+            self._stop.set()
+            self._cond.notify_all()
+
+    def stopped(self):
+        return self._stop.isSet()
+
+    def waitIdle(self):
+        """Block until the last frame given to send() has been sent,
+        re-raising any exception sending it raised"""
+        with self._cond:
+            while self._frame is not None and not self.stopped():
+                self._cond.wait()
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self._frame is None and not self.stopped():
+                    self._cond.wait()
+                if self.stopped():
+                    break
+                frame = self._frame
+            start = time.time()
+            error = None
+            try:
+                self._led._sendFrame(frame)
+            except Exception as e:
+                # keep running, the caller gets it from waitIdle
+                error = e
+            with self._cond:
+                self.lastSend = (time.time() - start) * 1000.0
+                self.totalSend += self.lastSend
+                self.sent += 1
+                self._frame = None
+                self.error = error
+                self._cond.notify_all()
+
+
+class bufferWindow(object):
+    """
+    Read only window onto a range of a larger buffer, used to give each
+    driver its section of LEDBase.buffer without copying it.
+    memoryview would be the natural fit but on Python 2 it returns
+    single character strings instead of ints which the drivers can't use.
+    """
+
+    def __init__(self, buf, start, length):
+        self._buf = buf
+        self._start = start
+        self._len = length
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return iter(self._buf[self._start:self._start + self._len])
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._len)
+            if step < 0:
+                return self._buf[self._start:self._start + self._len][key]
+            return self._buf[self._start + start:self._start + stop:step]
+        if key < 0:
+            key += self._len
+        if key < 0 or key >= self._len:
+            raise IndexError("bufferWindow index out of range")
+        return self._buf[self._start + key]
 
 
 class LEDBase(object):
 
-    def __init__(self, driver, threadedUpdate, masterBrightness, masterBrightnessLimit):
-        """Base LED class. Use LEDStrip or LEDMatrix instead!"""
+    def __init__(self, driver, threadedUpdate, masterBrightness, masterBrightnessLimit, compactBuffer=False):
+        """Base LED class. Use LEDStrip or LEDMatrix instead!
+        compactBuffer - store pixel data in a bytearray instead of a list of ints.
+            Uses far less memory and allows bulk operations but every color
+            channel must then be an int from 0 - 255
+        """
         if not isinstance(driver, list):
             driver = [driver]
 
@@ -63,8 +287,17 @@ class LEDBase(object):
         self.bufByteCount = int(3 * self.numLEDs)
         self._last_i = self.lastIndex = self.numLEDs - 1
 
-        self.buffer = [0 for x in range(self.bufByteCount)]
+        self._compactBuffer = compactBuffer
+        self.buffer = self._newBuffer()
         self.unscaledbuffer = self.buffer
+        self._driverData = []
+        self._updatePool = None
+        self._pipeline = None
+        self._pipelineBuffer = None
+        self._pipelineCopyBack = True
+        self._lastUpdate = None
+        self._commitBarrier = False
+        self._arrayView = False
 
         self._frameGenTime = 0
         self._frameTotalTime = None
@@ -95,6 +328,7 @@ class LEDBase(object):
             self.__scaleBrightness = self.masterBrightness
         else:
             self.__scaleBrightness = 255
+        self.__scaleTable = _scaleTable(self.__scaleBrightness)
 
         self.setMasterBrightness(self.masterBrightness)
         self.__masterBrightnessInitial = self.masterBrightness
@@ -108,6 +342,20 @@ class LEDBase(object):
     def cleanup(self):
         return self.__exit__(None, None, None)
 
+    def _newBuffer(self, data=None):
+        """
+        returns a new buffer of the configured type, bufByteCount long
+        or a copy of data if given
+        """
+        if self._compactBuffer:
+            if data is None:
+                return bytearray(self.bufByteCount)
+            return bytearray(data)
+        else:
+            if data is None:
+                return [0] * self.bufByteCount
+            return list(data)
+
     def _get_base(self, pixel):
         if(pixel < 0 or pixel > self._last_i):
             return (0, 0, 0)  # don't go out of bounds
@@ -132,16 +380,127 @@ class LEDBase(object):
         try:
             if pixel < 0 or pixel > self._last_i: raise IndexError()
             if self.__scaleBrightness < 255:
+                table = self.__scaleTable[0]
+                try:
+                    scaled = (table[color[0]], table[color[1]], table[color[2]])
+                except IndexError:
+                    # channels over 255 are scaled as 255, so that the pixel
+                    # is still written to both buffers
+                    scaled = tuple(table[min(max(v, 0), 255)] for v in (color[0], color[1], color[2]))
                 self.unscaledbuffer[pixel*3:(pixel*3)+3] = color
-                self.buffer[pixel*3 + 0] = (color[0] * self.__scaleBrightness) >> 8
-                self.buffer[pixel*3 + 1] = (color[1] * self.__scaleBrightness) >> 8
-                self.buffer[pixel*3 + 2] = (color[2] * self.__scaleBrightness) >> 8
+                self.buffer[pixel*3:(pixel*3)+3] = scaled
             else:
                 self.buffer[pixel*3:(pixel*3)+3] = color
                 # and self.unscaledbuffer is the same as self.buffer
         except IndexError:
             pass
 
+    def _setBytes_base(self, pixel, data):
+        """
+        copies data, the r,g,b values of consecutive pixels, into the buffer
+        starting at pixel. The whole range must already be within the buffer
+        """
+        start = pixel * 3
+        end = start + len(data)
+        if self.__scaleBrightness < 255:
+            self.unscaledbuffer[start:end] = data
+            if self._compactBuffer:
+                self.buffer[start:end] = self.unscaledbuffer[start:end].translate(self.__scaleTable[1])
+            else:
+                table = self.__scaleTable[0]
+                self.buffer[start:end] = [table[v] for v in data]
+        else:
+            self.buffer[start:end] = data
+
+    def _fill_base(self, start, end, color):
+        """
+        sets every pixel from start to end, inclusive, to color with a single
+        slice assignment. start and end must already be within range
+        """
+        count = end - start + 1
+        if count <= 0:
+            return
+        if self.__scaleBrightness < 255:
+            self.unscaledbuffer[start*3:(end+1)*3] = self._newBuffer(color) * count
+            table = self.__scaleTable[0]
+            color = (table[color[0]], table[color[1]], table[color[2]])
+        self.buffer[start*3:(end+1)*3] = self._newBuffer(color) * count
+
+    def _setPixels_base(self, pixels, colors):
+        """
+        sets each pixel index in pixels to the matching color in colors, or all of
+        them to colors if it is a single color. Out of range pixels are skipped
+        """
+        if numpy is not None and self._compactBuffer and (
+                isinstance(pixels, numpy.ndarray) or isinstance(colors, numpy.ndarray)):
+            self.__setPixelsArray(pixels, colors)
+            return
+
+        if numpy is not None:  # keep NumPy scalars out of list buffers
+            if isinstance(pixels, numpy.ndarray):
+                pixels = pixels.ravel().tolist()
+            if isinstance(colors, numpy.ndarray):
+                colors = colors.reshape(-1, 3).tolist() if colors.ndim > 1 else colors.tolist()
+
+        last = self._last_i
+        buf = self.buffer
+        unscaled = self.unscaledbuffer
+        table = self.__scaleTable[0]
+        scaled = self.__scaleBrightness < 255
+
+        if _isColor(colors):
+            color = self._newBuffer(colors)
+            scaledColor = self._newBuffer((table[color[0]], table[color[1]], table[color[2]]))
+            for p in pixels:
+                if 0 <= p <= last:
+                    i = p * 3
+                    if scaled:
+                        unscaled[i:i+3] = color
+                        buf[i:i+3] = scaledColor
+                    else:
+                        buf[i:i+3] = color
+        else:
+            for p, c in itertools.izip(pixels, colors):
+                if 0 <= p <= last:
+                    i = p * 3
+                    if scaled:
+                        unscaled[i:i+3] = c
+                        buf[i:i+3] = (table[c[0]], table[c[1]], table[c[2]])
+                    else:
+                        buf[i:i+3] = c
+
+    def __setPixelsArray(self, pixels, colors):
+        """_setPixels_base for compact buffers using NumPy fancy indexing"""
+        pixels = numpy.asarray(pixels, dtype=numpy.intp).ravel()
+        keep = (pixels >= 0) & (pixels <= self._last_i)
+        pixels = pixels[keep]
+        colors = numpy.asarray(colors, dtype=numpy.uint8)
+        if colors.ndim > 1:
+            colors = colors.reshape(-1, 3)[keep]
+        numpy.frombuffer(self.unscaledbuffer, dtype=numpy.uint8).reshape(-1, 3)[pixels] = colors
+        if self.buffer is not self.unscaledbuffer:
+            table = numpy.frombuffer(self.__scaleTable[1], dtype=numpy.uint8)
+            numpy.frombuffer(self.buffer, dtype=numpy.uint8).reshape(-1, 3)[pixels] = table[colors]
+
+    def asarray(self):
+        """Returns a writable NumPy (LEDs, 3) uint8 view of the unscaled pixel
+        data in buffer order. Requires compactBuffer. Software brightness is
+        applied to anything written through the view on the next update()
+        """
+        _requireNumpy()
+        if not self._compactBuffer:
+            raise TypeError("asarray requires compactBuffer=True")
+        self._arrayView = True
+        return numpy.frombuffer(self.unscaledbuffer, dtype=numpy.uint8).reshape(-1, 3)
+
+    def setPixels(self, pixels, colors):
+        """Set many pixels at once
+        pixels - sequence of pixel indices, out of range ones are skipped
+        colors - a single RGB color tuple for all pixels or a sequence of them,
+            one per pixel. NumPy arrays may be used for both
+        """
+        self._setPixels_base(pixels, colors)
+
     # NOTE this stops the thread associated with the driver associated with
     # the led so if a later led has the same drivers this will stop its threads
     def stopUpdateThreads(self):
@@ -149,26 +508,198 @@ class LEDBase(object):
             for d in self.driver:
                 d._thread.stop()
                 d._thread.join()  # if want thread at this point
+        else:
+            self.setPipelinedUpdate(False)
+        self.setParallelUpdate(False)
+
+    def setParallelUpdate(self, enable=True, workers=0, commitBarrier=False):
+        """Send each frame to all drivers at once on a pool of worker threads
+        instead of one after the other. Cannot be used with threadedUpdate.
+        workers - number of threads in the pool, 0 for one per driver
+        commitBarrier - wait until every driver has its frame then call commit()
+            on all of them, for drivers that can hold a frame until told to
+            show it, see DriverBase.commit. None of the included drivers can:
+            they show each frame as it is sent, so this does not make them
+            change together
+        """
+        if enable and self._threadedUpdate:
+            error = "Parallel update cannot be used with threadedUpdate"
+            log.logger.error(error)
+            raise RuntimeError(error)
+
+        if self._updatePool:
+            self._updatePool.stop()
+            self._updatePool = None
+        if enable:
+            self._updatePool = workerPool(workers or len(self.driver))
+        self._commitBarrier = enable and commitBarrier
+        for d in self.driver:
+            d.deferCommit = self._commitBarrier
 
     def waitForUpdate(self):
+        """Block until every driver has finished sending its frames"""
+        if self._threadedUpdate:
+            for d in self.driver:
+                d._thread.waitIdle()
+        elif self._pipeline:
+            self._pipeline.waitIdle()
+
+    def setUpdatePolicy(self, policy, queueSize=1):
+        """Sets what threaded updates do when a driver is still busy sending
+        policy - one of UpdatePolicy
+        queueSize - frames that may wait per driver with UpdatePolicy.DROP_OLDEST
+        """
+        if self._threadedUpdate:
+            for d in self.driver:
+                d._thread.policy = policy
+                d._thread.queueSize = max(1, queueSize)
+
+    def droppedFrames(self):
+        """Returns the number of frames each driver dropped under its update policy"""
+        if self._threadedUpdate:
+            return [d._thread.droppedFrames for d in self.driver]
+        return [0 for d in self.driver]
+
+    def _getDriverData(self, buf=None):
+        """
+        returns a list of (driver, data) where data is the section of buf,
+        self.buffer by default, for that driver. Sections are windows on the
+        buffer, not copies, and are kept for the last two buffers used
+        """
+        if buf is None:
+            buf = self.buffer
+        for source, driverData in self._driverData:
+            if source is buf:
+                return driverData
+
+        if len(self.driver) == 1 and self.driver[0].bufByteCount == self.bufByteCount:
+            driverData = [(self.driver[0], buf)]
+        else:
+            driverData = []
+            pos = 0
+            for d in self.driver:
+                driverData.append((d, bufferWindow(buf, pos, d.bufByteCount)))
+                pos += d.bufByteCount
+        self._driverData = [(buf, driverData)] + self._driverData[:1]
+        return driverData
+
+    def _sendFrame(self, driverData):
+        """sends each (driver, data) from _getDriverData, waiting until done"""
+        if self._updatePool:
+            jobs = [self._updatePool.submit(d._update, data) for d, data in driverData]
+            for j in jobs:
+                j.wait()
+            if self._commitBarrier:
+                self._updatePool.map(lambda d: d.commit(), self.driver)
+            return
+
+        for d, data in driverData:
+            d._update(data)
+
+    def setPipelinedUpdate(self, enable=True, copyBack=True):
+        """Send each frame on a separate thread while the next one is drawn.
+        update() hands the buffer to the sender and swaps in a second buffer
+        to draw the next frame into, only waiting if the previous frame is
+        still being sent. Not used with threadedUpdate.
+        copyBack - start each new frame as a copy of the one just sent, as most
+            animations draw over the previous frame. Set False to skip the
+            copy if every frame is drawn from scratch
+        Any references to buffer, or views from asarray(), only stay valid
+        until the next update()
+        """
         if self._threadedUpdate:
-            while all([d._thread.sending() for d in self.driver]):
-                time.sleep(0.000001)
+            error = "Pipelined update cannot be used with threadedUpdate"
+            log.logger.error(error)
+            raise RuntimeError(error)
+
+        if self._pipeline:
+            try:
+                self._pipeline.waitIdle()
+            finally:
+                self._pipeline.stop()
+                self._pipeline.join()
+                self._pipeline = None
+                self._pipelineBuffer = None
+        if enable:
+            self._pipelineBuffer = self._newBuffer()
+            self._pipeline = pipelineThread(self)
+            self._pipeline.start()
+        self._pipelineCopyBack = copyBack
+        self._lastUpdate = None
+
+    def pipelineTimes(self):
+        """Returns the timings in ms of the stages of a pipelined update as a dict
+        of the last and average render (between updates), stall (waiting for
+        the sender), swap (buffer swap and copy back) and send times
+        """
+        p = self._pipeline
+        if not p:
+            return None
+        n = max(p.frames, 1)
+        return {
+            "frames": p.frames,
+            "render": p.lastRender, "avgRender": p.totalRender / n,
+            "stall": p.lastStall, "avgStall": p.totalStall / n,
+            "swap": p.lastSwap, "avgSwap": p.totalSwap / n,
+            "send": p.lastSend, "avgSend": p.totalSend / max(p.sent, 1)
+        }
+
+    def _pipelinedUpdate(self):
+        p = self._pipeline
+        start = time.time()
+        if self._lastUpdate is not None:
+            p.lastRender = (start - self._lastUpdate) * 1000.0
+            p.totalRender += p.lastRender
+        p.waitIdle()
+        swap = time.time()
+
+        front = self.buffer
+        back = self._pipelineBuffer
+        if len(back) != len(front):
+            back = self._newBuffer()
+        if self._pipelineCopyBack:
+            back[:] = front
+        if self.unscaledbuffer is front:
+            self.unscaledbuffer = back
+        self.buffer = back
+        self._pipelineBuffer = front
+        p.send(self._getDriverData(front))
+
+        self._lastUpdate = time.time()
+        p.lastStall = (swap - start) * 1000.0
+        p.lastSwap = (self._lastUpdate - swap) * 1000.0
+        p.totalStall += p.lastStall
+        p.totalSwap += p.lastSwap
+        p.frames += 1
 
     def update(self):
         """Push the current pixel state to the driver"""
-        pos = 0
-        self.waitForUpdate()
-
         if len(self.buffer) != self.bufByteCount:
             raise IOError("Data buffer size incorrect! Expected: {} bytes / Received: {} bytes".format(self.bufByteCount, len(self.buffer)))
 
-        for d in self.driver:
+        if self._arrayView and self.buffer is not self.unscaledbuffer:
+            # writes through asarray() bypass brightness scaling
+            self.buffer[:] = self.unscaledbuffer.translate(self.__scaleTable[1])
+
+        if self._pipeline:
+            self._pipelinedUpdate()
+            return
+
+        if self._updatePool:
+            self._sendFrame(self._getDriverData())
+            return
+
+        if self._threadedUpdate and any(d._thread.policy == UpdatePolicy.BLOCK for d in self.driver):
+            # hand out the frame only once every driver is done with the last
+            # one, so a fast driver never gets ahead of a slow one
+            self.waitForUpdate()
+
+        for d, data in self._getDriverData():
             if self._threadedUpdate:
-                d._thread.setData(self.buffer[pos:d.bufByteCount+pos])
+                # the thread sends while the next frame is drawn so needs its own copy
+                d._thread.setData(data[:])
             else:
-                d._update(self.buffer[pos:d.bufByteCount+pos])
-            pos += d.bufByteCount
+                d._update(data)
 
     def lastThreadedUpdate(self):
         return max([d.lastUpdate for d in self.driver])
@@ -182,12 +713,25 @@ class LEDBase(object):
         """
         if len(buf) != self.bufByteCount:
             raise ValueError("For this display type and {0} LEDs, buffer must have {1} bytes but has {2}".format(self.bufByteCount/3, self.bufByteCount, len(buf)))
+
+        if self._compactBuffer:
+            # copy into the existing buffers so their ids never change
+            self.unscaledbuffer[:] = buf
+            if self.__scaleBrightness == 255:
+                self.buffer = self.unscaledbuffer
+            else:
+                if self.buffer is self.unscaledbuffer:
+                    self.buffer = self._newBuffer()
+                self.buffer[:] = self.unscaledbuffer.translate(self.__scaleTable[1])
+            return
+
         self.unscaledbuffer = buf
 
         if self.__scaleBrightness == 255:
             self.buffer = self.unscaledbuffer
         else:
-            self.buffer = [(c * self.__scaleBrightness) >> 8 for c in self.unscaledbuffer]
+            table = self.__scaleTable[0]
+            self.buffer = [table[c] for c in self.unscaledbuffer]
 
     def changeBrightness(self, brightness):
         self.setMasterBrightness(brightness)
@@ -216,6 +760,7 @@ class LEDBase(object):
 
         if not self.__allDriversHandleBrightness:
             self.__scaleBrightness = self.masterBrightness
+            self.__scaleTable = _scaleTable(self.__scaleBrightness)
         else:
         # self.__scaleBrightness remains 255
             for d in self.driver:
@@ -223,6 +768,9 @@ class LEDBase(object):
 
         if self.__scaleBrightness == 255:  # make both buffers same id
             self.buffer = self.unscaledbuffer
+        elif self._compactBuffer:  # self.buffer made different id, unscaledbuffer keeps its id
+            if self.buffer is self.unscaledbuffer:
+                self.buffer = self._newBuffer(self.unscaledbuffer)
         else:  # self.unscaledbuffer made different id from self.buffer
             self.unscaledbuffer = [v for v in self.unscaledbuffer]
   
@@ -250,12 +798,9 @@ class LEDBase(object):
         """
         resets to all zero without changing the list id
         """
-        for i in range(self.bufByteCount):
-            self.buffer[i] = 0
-        if self.buffer is self.unscaledbuffer:
-            return
-        for i in range(self.bufByteCount):
-            self.unscaledbuffer[i] = 0
+        self.buffer[:] = self._newBuffer()
+        if self.buffer is not self.unscaledbuffer:
+            self.unscaledbuffer[:] = self._newBuffer()
 
     # Fill the strand (or a subset) with a single color using a Color object
     def fill(self, color, start=0, end=-1):
@@ -264,8 +809,7 @@ class LEDBase(object):
             start = 0
         if end < 0 or end > self._last_i:
             end = self._last_i
-        for led in range(start, end + 1):  # since 0-index include end in range
-            self._set_base(led, color)
+        self._fill_base(start, end, color)  # since 0-index include end in range
 
     # Fill the strand (or a subset) with a single color using RGB values
     def fillRGB(self, r, g, b, start=0, end=-1):
@@ -281,8 +825,8 @@ class LEDBase(object):
 class LEDStrip(LEDBase):
 
     def __init__(self, driver, threadedUpdate = False, masterBrightness=255,
-                 pixelWidth=1, masterBrightnessLimit=255):
-        super(LEDStrip, self).__init__(driver, threadedUpdate, masterBrightness, masterBrightnessLimit)
+                 pixelWidth=1, masterBrightnessLimit=255, compactBuffer=False):
+        super(LEDStrip, self).__init__(driver, threadedUpdate, masterBrightness, masterBrightnessLimit, compactBuffer)
 
         self.pixelWidth = pixelWidth
         if self.pixelWidth < 1 or self.pixelWidth > self.numLEDs:
@@ -306,6 +850,30 @@ class LEDStrip(LEDBase):
         for p in range(start, start+self.pixelWidth):
             self._set_base(p, color)
 
+    def setPixels(self, pixels, colors):
+        """Set many (possibly scaled) pixels at once, see LEDBase.setPixels"""
+        pw = self.pixelWidth
+        if pw == 1:
+            self._setPixels_base(pixels, colors)
+            return
+
+        if numpy is not None and self._compactBuffer:
+            pixels = numpy.asarray(pixels, dtype=numpy.intp).ravel()
+            keep = (pixels >= 0) & (pixels <= self.lastIndex)
+            pixels = pixels[keep]
+            if not _isColor(colors):
+                colors = numpy.repeat(numpy.asarray(colors).reshape(-1, 3)[keep], pw, axis=0)
+            pixels = (pixels[:, None] * pw + numpy.arange(pw)).ravel()
+        else:
+            last = self.lastIndex
+            if _isColor(colors):
+                pixels = [p * pw + i for p in pixels if 0 <= p <= last for i in range(pw)]
+            else:
+                pairs = [(p, c) for p, c in itertools.izip(pixels, colors) if 0 <= p <= last]
+                pixels = [p * pw + i for p, c in pairs for i in range(pw)]
+                colors = [c for p, c in pairs for i in range(pw)]
+        self._setPixels_base(pixels, colors)
+
     def get(self, pixel):
         """Get RGB color tuple of color at index (possibly scaled) pixel"""
         return self._get_base(pixel * self.pixelWidth)
@@ -333,8 +901,8 @@ class LEDStrip(LEDBase):
             start = 0
         if end < 0 or end > self.lastIndex:
             end = self.lastIndex
-        for led in range(start, end + 1):  # since 0-index include end in range
-            self.set(led, color)
+        # since 0-index include end in range, each pixel is pixelWidth LEDs
+        self._fill_base(start * self.pixelWidth, (end + 1) * self.pixelWidth - 1, color)
 
 class MatrixRotation:
     ROTATE_0 = 0   #no rotation
@@ -390,7 +958,8 @@ class LEDMatrix(LEDBase):
     def __init__(self, driver, width = 0, height = 0, coordMap = None,
                  rotation = MatrixRotation.ROTATE_0, vert_flip = False,
                  serpentine = True, threadedUpdate = False,
-                 masterBrightness=255, pixelSize=(1,1), masterBrightnessLimit=255):
+                 masterBrightness=255, pixelSize=(1,1), masterBrightnessLimit=255,
+                 compactBuffer=False):
         """Main class for matricies.
         driver - instance that inherits from DriverBase
         width - X axis size of matrix
@@ -398,8 +967,9 @@ class LEDMatrix(LEDBase):
         coordMap - a 2D matrix defining the X,Y to strip index mapping. Not needed in most cases
         rotation - how to rotate when generating the map. Not used if coordMap specified
         vert_flip - flips the generated map along the Y axis. This along with rotation can achieve any orientation
+        compactBuffer - store pixel data in a bytearray, see LEDBase
         """
-        super(LEDMatrix, self).__init__(driver, threadedUpdate, masterBrightness, masterBrightnessLimit)
+        super(LEDMatrix, self).__init__(driver, threadedUpdate, masterBrightness, masterBrightnessLimit, compactBuffer)
 
         if width == 0 and height == 0:
             if len(self.driver) == 1:
@@ -426,20 +996,20 @@ class LEDMatrix(LEDBase):
             raise TypeError("width * height MUST equal the total pixel count!")
 
         if coordMap:
-            self.matrix_map = coordMap
+            mm = coordMap
         else:
             if len(self.driver) == 1:
-                self.matrix_map = mapGen(self.width, self.height, serpentine)
+                mm = mapGen(self.width, self.height, serpentine)
             else:
                 raise TypeError("Must provide coordMap if using multiple drivers!")
 
         #apply rotation
         for i in range(rotation):
-            self.matrix_map = zip(*self.matrix_map[::-1])
+            mm = zip(*mm[::-1])
 
         #apply flip
         if vert_flip:
-            self.matrix_map = self.matrix_map[::-1]
+            mm = mm[::-1]
 
         #if 90 or 270 rotation dimensions need to be swapped so they match the matrix rotation
         if rotation % 2 != 0:
@@ -448,8 +1018,10 @@ class LEDMatrix(LEDBase):
             self.width = h
             self.height = w
 
-        self.texture = None
+        self._textureSource = None
+        self._texture = None
         self.set = self._setColor
+        self._pixelLookup = None
 
         if pw < 0 or pw > self.width or ph < 0 or ph > self.height:
             raise ValueError("pixelSize must be greater than 0 and not larger than total matrix!")
@@ -464,64 +1036,235 @@ class LEDMatrix(LEDBase):
             self.height = self.height/ph
             self.numLEDs = self.width * self.height
 
+        self.mapStride = pw * ph
+        self.flatMap = self.__compileMap(mm)
+        self._rowRuns = self.__findRowRuns()
+        #true if every LED is in the map exactly once so the screen can be filled as one slice
+        self._fullMap = sorted(self.flatMap) == range(self.bufByteCount / 3)
+
+    @property
+    def matrix_map(self):
+        """The coordinate map, with rotation, flip and pixelSize applied, as
+        rows of buffer indices. Rebuilt from flatMap each time it is read
+        """
+        pw, ph = self.pixelSize
+        w = self.width
+        k = self.mapStride
+        flat = self.flatMap
+        return [[flat[((sy / ph) * w + sx / pw) * k + (sy % ph) * pw + sx % pw]
+                 for sx in range(w * pw)] for sy in range(self.height * ph)]
+
+    @property
+    def texture(self):
+        """The texture given to setTexture. Setting it calls setTexture"""
+        return self._textureSource
+
+    @texture.setter
+    def texture(self, tex):
+        self.setTexture(tex)
+
     def setTexture(self, tex = None):
-        if tex == None:
-            self.texture = tex
+        """Sets the texture used when drawing without a color, or clears it if None.
+        tex - either a list of height rows, each a list of width RGB tuples, or
+        an array of height * width * 3 values in row order, such as a NumPy
+        (height, width, 3) array or a bytearray. Stored as a compact bytearray
+        copy, so changes made to tex afterwards are only drawn once it is
+        passed to setTexture again
+        """
+        if tex is None:
+            self._textureSource = tex
+            self._texture = None
             self.set = self._setColor
         else:
-            if not isinstance(tex, list):
-                raise ValueError("Texture must be a list!")
-            elif len(tex) != self.height:
-                raise ValueError("Given texture is must be {} high!".format(self.height))
-            else:
+            if isinstance(tex, list):
+                if len(tex) != self.height:
+                    raise ValueError("Given texture is must be {} high!".format(self.height))
                 for r in tex:
                     if not isinstance(r, list):
                         raise ValueError("Texture rows must be lists!")
                     elif len(r) != self.width:
                         raise ValueError("Texture rows must be {} wide!".format(self.width))
+                data = [v for r in tex for c in r for v in c]
+            elif numpy is not None and isinstance(tex, numpy.ndarray):
+                if tex.shape != (self.height, self.width, 3):
+                    raise ValueError("Texture array must have shape ({}, {}, 3)!".format(self.height, self.width))
+                data = tex.astype(numpy.uint8).tostring()
+            else:
+                data = tex
+
+            try:
+                data = bytearray(data)
+            except (TypeError, ValueError):
+                raise ValueError("Texture colors must be ints from 0 - 255!")
+            if len(data) != self.width * self.height * 3:
+                raise ValueError("Texture must have {} RGB colors!".format(self.width * self.height))
 
-            self.texture = tex
+            self._textureSource = tex
+            self._texture = data
             self.set = self._setTexture
 
+    def __compileMap(self, mm):
+        """
+        flattens the coordinate map mm, with rotation and flip already
+        applied, and pixelSize into one array of buffer indices. The
+        mapStride indices for logical pixel x,y start at
+        flatMap[(y * width + x) * mapStride]. Cells missing from mm are -1
+        """
+        pw, ph = self.pixelSize
+        flat = array.array("i")
+        for y in range(self.height):
+            for x in range(self.width):
+                for sy in range(y * ph, (y + 1) * ph):
+                    for sx in range(x * pw, (x + 1) * pw):
+                        try:
+                            flat.append(mm[sy][sx])
+                        except IndexError:
+                            flat.append(-1)
+        return flat
+
+    def __findRowRuns(self):
+        """
+        returns (start, step) for each row whose pixels are consecutive in the
+        buffer, step being 1 or -1, so spans on it can be set as a single slice.
+        None for other rows and when pixels are scaled
+        """
+        runs = []
+        w = self.width
+        for y in range(self.height):
+            row = self.flatMap[y * w:(y + 1) * w].tolist()
+            run = None
+            if self.mapStride == 1 and min(row) >= 0 and max(row) <= self._last_i:
+                step = 1 if w == 1 else row[1] - row[0]
+                if step in (1, -1) and row == range(row[0], row[0] + step * w, step):
+                    run = (row[0], step)
+            runs.append(run)
+        return runs
+
     def __setNormal(self, x, y, color):
-        try:
-            pixel = self.matrix_map[y][x]
-            self._set_base(pixel, color)
-        except IndexError:
-            pass
+        w = self.width
+        if x >= 0 and y >= 0 and x < w and y < self.height:
+            self._set_base(self.flatMap[y * w + x], color)
 
     def __setScaled(self, x, y, color):
-        sx = x*self.pixelSize[0]
-        sy = y*self.pixelSize[1]
-
-        for xs in range(sx, sx+self.pixelSize[0]):
-            for ys in range(sy, sy+self.pixelSize[1]):
-                self.__setNormal(xs, ys, color)
+        w = self.width
+        if x >= 0 and y >= 0 and x < w and y < self.height:
+            i = (y * w + x) * self.mapStride
+            for pixel in self.flatMap[i:i + self.mapStride]:
+                self._set_base(pixel, color)
 
     #Set single pixel to Color value
     def _setColor(self, x, y, color = (0,0,0)):
         if color == None: color = (0,0,0)
-        try:
-            if x<0 or y<0: raise IndexError()
-            self._set(x, y, color)
-        except IndexError:
-            pass
+        self._set(x, y, color)
 
     def _setTexture(self, x, y, color = None):
-        try:
-            if x<0 or y<0: raise IndexError()
-            if color == None:
-                color = self.texture[y][x]
-            self._set(x, y, color)
-        except IndexError:
-            pass
+        if color is None:
+            if x < 0 or y < 0 or x >= self.width or y >= self.height:
+                return
+            i = (y * self.width + x) * 3
+            color = self._texture[i:i + 3]
+        self._set(x, y, color)
 
     def get(self, x, y):
-        try:
-            pixel = self.matrix_map[y * self.pixelSize[1]][x * self.pixelSize[0]]
-            return self._get_base(pixel)
-        except IndexError:
-            return (0,0,0)
+        w = self.width
+        if x >= 0 and y >= 0 and x < w and y < self.height:
+            return self._get_base(self.flatMap[(y * w + x) * self.mapStride])
+        return (0,0,0)
+
+    def setPixels(self, xs, ys, colors=None):
+        """Set many pixels at once, skipping any that are off the matrix
+        xs, ys - sequences of x and y coordinates
+        colors - a single RGB color tuple for all pixels or a sequence of them,
+            one per pixel. If None the texture is used if set, otherwise Off.
+            NumPy arrays may be used for all three
+        """
+        if colors is None and self._texture is None:
+            colors = (0, 0, 0)
+        if numpy is not None and self._compactBuffer:
+            pixels, colors = self.__mapPixelsArray(xs, ys, colors)
+        else:
+            pixels, colors = self.__mapPixels(xs, ys, colors)
+        self._setPixels_base(pixels, colors)
+
+    def __mapPixels(self, xs, ys, colors):
+        """
+        converts x,y coordinates to buffer indices, dropping those off the matrix
+        and expanding scaled pixels, and returns (pixels, colors) to match
+        """
+        w, h = self.width, self.height
+        k = self.mapStride
+        tex = self._texture
+        flat = self.flatMap
+        single = colors is not None and _isColor(colors)
+        if single or colors is None:
+            colorSeq = itertools.repeat(colors)
+        else:
+            colorSeq = colors
+
+        pixels = []
+        mapped = []
+        for x, y, c in itertools.izip(xs, ys, colorSeq):
+            if 0 <= x < w and 0 <= y < h:
+                i = y * w + x
+                if c is None:
+                    c = tex[i * 3:i * 3 + 3]
+                i *= k
+                pixels.extend(flat[i:i + k])
+                mapped.extend([c] * k)
+        if single:
+            return pixels, colors
+        return pixels, mapped
+
+    def _getPixelLookup(self):
+        """
+        returns a NumPy array with a row of buffer indices for each logical
+        pixel, indexed by y * width + x. Scaled pixels have more than one index
+        """
+        if self._pixelLookup is None:
+            # a view on flatMap, not a copy
+            flat = numpy.frombuffer(self.flatMap, dtype=numpy.intc)
+            self._pixelLookup = flat.reshape(self.width * self.height, self.mapStride)
+        return self._pixelLookup
+
+    def __mapPixelsArray(self, xs, ys, colors):
+        """__mapPixels using NumPy"""
+        w, h = self.width, self.height
+        xs = numpy.asarray(xs, dtype=numpy.intp).ravel()
+        ys = numpy.asarray(ys, dtype=numpy.intp).ravel()
+        keep = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+        xs = xs[keep]
+        ys = ys[keep]
+        lookup = self._getPixelLookup()
+        pixels = lookup[ys * w + xs].ravel()
+        if colors is None:
+            colors = numpy.frombuffer(self._texture, dtype=numpy.uint8).reshape(h, w, 3)[ys, xs]
+        elif _isColor(colors):
+            return pixels, colors
+        else:
+            colors = numpy.asarray(colors, dtype=numpy.uint8).reshape(-1, 3)[keep]
+        if lookup.shape[1] > 1:
+            colors = numpy.repeat(colors, lookup.shape[1], axis=0)
+        return pixels, colors
+
+    def to_array(self):
+        """Returns a NumPy (height, width, 3) uint8 copy of the display in
+        logical x,y coordinates, following matrix_map, rotation and pixelSize.
+        A copy as the mapping can't generally be expressed as a view
+        """
+        _requireNumpy()
+        data = numpy.asarray(self.unscaledbuffer, dtype=numpy.uint8).reshape(-1, 3)
+        return data[self._getPixelLookup()[:, 0]].reshape(self.height, self.width, 3)
+
+    def from_array(self, frame):
+        """Sets the whole display from a (height, width, 3) array of colors in
+        logical x,y coordinates, such as one returned by to_array()
+        """
+        _requireNumpy()
+        lookup = self._getPixelLookup()
+        frame = numpy.asarray(frame, dtype=numpy.uint8).reshape(self.height * self.width, 3)
+        if lookup.shape[1] > 1:
+            frame = numpy.repeat(frame, lookup.shape[1], axis=0)
+        self._setPixels_base(lookup.ravel(), frame)
 
     def setHSV(self, x, y, hsv):
         color = colors.hsv2rgb(hsv)
@@ -632,6 +1375,14 @@ class LEDMatrix(LEDBase):
     #Bresenham's algorithm - thx wikpedia
     def drawLine(self, x0, y0, x1, y1, color = None, colorFunc = None):
         """Draw line from point x0,y0 to x,1,y1. Will draw beyond matrix bounds."""
+        if colorFunc is None:
+            if y0 == y1:
+                self._fillHSpan(min(x0, x1), y0, abs(x1 - x0) + 1, color)
+                return
+            if x0 == x1:
+                self._fillVSpan(x0, min(y0, y1), abs(y1 - y0) + 1, color)
+                return
+
         steep = abs(y1-y0) > abs(x1-x0)
         if steep:
             x0,y0 = y0,x0
@@ -667,11 +1418,102 @@ class LEDMatrix(LEDBase):
                 y0 += ystep
                 err += dx
 
+    def _fillHSpan(self, x, y, w, color = None):
+        """
+        Sets w pixels right from x,y after clipping to the matrix. Written as
+        one slice when the row is consecutive in the buffer
+        """
+        if y < 0 or y >= self.height:
+            return
+        x0 = max(x, 0)
+        x1 = min(x + w, self.width) - 1
+        if x1 < x0:
+            return
+        if color is None:
+            if self._texture is not None:
+                i = y * self.width
+                self._setRow(x0, y, self._texture[(i + x0) * 3:(i + x1 + 1) * 3])
+                return
+            color = (0, 0, 0)
+
+        run = self._rowRuns[y]
+        if run:
+            a = run[0] + run[1] * x0
+            b = run[0] + run[1] * x1
+            self._fill_base(min(a, b), max(a, b), color)
+        else:
+            k = self.mapStride
+            i = y * self.width
+            self._setPixels_base(self.flatMap[(i + x0) * k:(i + x1 + 1) * k], color)
+
+    def _fillVSpan(self, x, y, h, color = None):
+        """Sets h pixels down from x,y after clipping to the matrix"""
+        if x < 0 or x >= self.width:
+            return
+        y0 = max(y, 0)
+        y1 = min(y + h, self.height) - 1
+        if y1 < y0:
+            return
+        if color is None:
+            if self._texture is not None:
+                self.setPixels([x] * (y1 - y0 + 1), range(y0, y1 + 1))
+                return
+            color = (0, 0, 0)
+
+        w = self.width
+        k = self.mapStride
+        if k == 1:
+            pixels = self.flatMap[y0 * w + x:y1 * w + x + 1:w]
+        else:
+            pixels = []
+            for i in range(y0 * w + x, y1 * w + x + 1, w):
+                pixels.extend(self.flatMap[i * k:(i + 1) * k])
+        self._setPixels_base(pixels, color)
+
+    def _setRow(self, x, y, data):
+        """
+        Sets pixels right from x,y to the colors in data, a flat sequence of
+        r,g,b values, after clipping to the matrix. Written as one slice when
+        the row is consecutive in the buffer
+        """
+        if y < 0 or y >= self.height:
+            return
+        n = len(data) / 3
+        x0 = max(x, 0)
+        x1 = min(x + n, self.width) - 1
+        if x1 < x0:
+            return
+        data = data[(x0 - x) * 3:(x1 - x + 1) * 3]
+
+        run = self._rowRuns[y]
+        if run and run[1] == 1:
+            self._setBytes_base(run[0] + x0, data)
+        elif run:
+            # row runs right to left in the buffer so reverse the pixel order
+            rev = self._newBuffer(data)
+            rev[0::3] = data[-3::-3]
+            rev[1::3] = data[-2::-3]
+            rev[2::3] = data[-1::-3]
+            self._setBytes_base(run[0] - x1, rev)
+        else:
+            k = self.mapStride
+            i = y * self.width
+            colors = zip(data[0::3], data[1::3], data[2::3])
+            if k > 1:
+                colors = [c for c in colors for j in range(k)]
+            self._setPixels_base(self.flatMap[(i + x0) * k:(i + x1 + 1) * k], colors)
+
     def _drawFastVLine(self, x, y, h, color = None):
-        self.drawLine(x, y, x, y+h-1, color)
+        if h > 0:
+            self._fillVSpan(x, y, h, color)
+        else:
+            self.drawLine(x, y, x, y+h-1, color)
 
     def _drawFastHLine(self, x, y, w, color = None):
-        self.drawLine(x, y, x+w-1, y, color)
+        if w > 0:
+            self._fillHSpan(x, y, w, color)
+        else:
+            self.drawLine(x, y, x+w-1, y, color)
 
     def drawRect(self, x, y, w, h, color = None):
         """Draw rectangle with top-left corner at x,y, width w and height h"""
@@ -682,8 +1524,20 @@ class LEDMatrix(LEDBase):
 
     def fillRect(self, x, y, w, h, color = None):
         """Draw solid rectangle with top-left corner at x,y, width w and height h"""
-        for i in range(x, x+w):
-            self._drawFastVLine(i, y, h, color)
+        if h <= 0:
+            for i in range(x, x+w):
+                self._drawFastVLine(i, y, h, color)
+            return
+        if w <= 0:
+            return
+
+        if (self._fullMap and x <= 0 and y <= 0 and x + w >= self.width and y + h >= self.height
+                and (color is not None or self._texture is None)):
+            self._fill_base(0, self._last_i, color or (0, 0, 0))
+            return
+
+        for row in range(max(y, 0), min(y + h, self.height)):
+            self._fillHSpan(x, row, w, color)
 
     def fillScreen(self, color = None):
         """Fill the matrix with the given RGB color"""
@@ -779,39 +1633,18 @@ class LEDMatrix(LEDBase):
 
     def drawChar(self, x, y, c, color, bg, size):
         if size > 0:
-            FONT = font.GLCDFONT
-            fw, fh = 6, 8
+            fw, fh = 6 * size, 8 * size
         else:
-            FONT = font.TINYFONT
             fw, fh = 4, 6
-            size = 1
+        if x >= self.width or y >= self.height or x + fw <= 0 or y + fh <= 0:
+            return
 
-        c = ord(c) #make it the int value
-        #print size, chr(c), FONT[c]
-        for i in range(fw):
-            xPos = x+(i*size)
-            if ((xPos < self.width) and
-                (xPos + fw * size -1) >= 0):
-
-                if i == fw-1:
-                    line = 0
-                else:
-                    line = FONT[c][i]
-                for j in range(fh):
-                    yPos = y+(j*size)
-                    if ((yPos < self.height) and
-                        (yPos + fh * size -1) >= 0):
-                        if line & 0x1:
-                            if size == 1:
-                                self.set(xPos, yPos, color)
-                            else:
-                                self.fillRect(xPos, yPos, size, size, color)
-                        elif bg != color and bg != None:
-                            if size == 1:
-                                self.set(xPos, yPos, bg)
-                            else:
-                                self.fillRect(xPos, yPos, size, size, bg)
-                    line >>= 1
+        fg, bgSpans = _glyphSpans(ord(c), size)
+        for dx, dy, w in fg:
+            self._fillHSpan(x + dx, y + dy, w, color)
+        if bg != color and bg != None:
+            for dx, dy, w in bgSpans:
+                self._fillHSpan(x + dx, y + dy, w, bg)
 
     def drawText(self, text, x = 0, y = 0, color = None, bg = colors.Off, size = 1):
         osize = size
@@ -833,18 +1666,107 @@ class LEDMatrix(LEDBase):
                 if x >= self.width:
                     break
 
+class TextScroller(object):
+    """Scrolls a line of text across an LEDMatrix. The text is rendered once
+    into an off-screen strip and each frame only copies the visible window,
+    so frame time depends on the matrix width, not the text length.
+    led - LEDMatrix to draw on
+    text - message to scroll, newlines are shown as spaces
+    y - top row of the text on the matrix
+    color, bg, size - as for LEDMatrix.drawText, a bg of None draws Off
+    gap - blank columns between repeats of the text, defaults to matrix width
+    """
+
+    def __init__(self, led, text = "", y = 0, color = colors.White, bg = colors.Off, size = 1, gap = None):
+        if not isinstance(led, LEDMatrix):
+            raise RuntimeError("Must use LEDMatrix with TextScroller!")
+        self._led = led
+        self.y = y
+        self.color = color
+        self.bg = bg or colors.Off
+        self.size = size
+        if size > 0:
+            self._fw, self._fh = 6 * size, 8 * size
+        else:
+            self._fw, self._fh = 4, 6
+        self.gap = led.width if gap is None else gap
+        self.offset = 0
+        self.text = None
+        self.setText(text)
+
+    def setText(self, text):
+        """Replaces the message, dropping the old strip, unless it is unchanged"""
+        if text == self.text:
+            return
+        self.text = ""
+        self._rows = [bytearray() for r in range(self._fh)]
+        self._loop = None
+        self.offset = 0
+        self.append(text)
+
+    def append(self, text):
+        """Adds text to the end of the strip, rendering only the new characters"""
+        color = bytearray(self.color)
+        bg = bytearray(self.bg)
+        for c in text:
+            if c == '\r':
+                continue
+            if c == '\n':
+                c = ' '
+            start = len(self._rows[0])
+            for row in self._rows:
+                row.extend(bg * self._fw)
+            fg, unset = _glyphSpans(ord(c), self.size)
+            for dx, dy, w in fg:
+                self._rows[dy][start + dx * 3:start + (dx + w) * 3] = color * w
+        self.text += text
+        self._loop = None
+
+    @property
+    def stripWidth(self):
+        """Width of the rendered text in pixels"""
+        return len(self._rows[0]) / 3
+
+    def _buildLoop(self):
+        # strip + gap repeated enough that any window is one slice
+        period = self.stripWidth + self.gap
+        if period == 0:
+            # no text and no gap, so there is nothing to scroll but blank rows
+            self._loop = [bytearray(self.bg) * self._led.width for row in self._rows]
+            return
+        reps = (period + self._led.width) / period + 1
+        gap = bytearray(self.bg) * self.gap
+        self._loop = [(row + gap) * reps for row in self._rows]
+
+    def draw(self, offset = None):
+        """Draws the window of the strip starting offset pixels in, default self.offset"""
+        if offset is None:
+            offset = self.offset
+        if self._loop is None:
+            self._buildLoop()
+        period = self.stripWidth + self.gap
+        start = (offset % period) * 3 if period else 0
+        end = start + self._led.width * 3
+        for r, row in enumerate(self._loop):
+            self._led._setRow(0, self.y + r, row[start:end])
+
+    def scroll(self, amt = 1):
+        """Advances the text amt pixels to the left and draws it"""
+        self.offset += amt
+        self.draw()
+
 #Takes a matrix and displays it as individual columns over time
 class LEDPOV(LEDMatrix):
 
     def __init__(self, driver, povHeight, width, rotation = MatrixRotation.ROTATE_0,
                  vert_flip = False, threadedUpdate = False,
-                 masterBrightness=255, masterBrightnessLimit=255):
+                 masterBrightness=255, masterBrightnessLimit=255, compactBuffer=False):
         self.numLEDs = povHeight * width
         # send keyword parameters as a few in LEDMatrix were skipped
         super(LEDPOV, self).__init__(driver, width, povHeight, coordMap=None,
                 rotation=rotation, vert_flip=vert_flip,
                 threadedUpdate=threadedUpdate, masterBrightness=masterBrightness,
-                masterBrightnessLimit=masterBrightnessLimit)
+                masterBrightnessLimit=masterBrightnessLimit, compactBuffer=compactBuffer)
 
     #This is the magic. Overriding the normal update() method
     #It will automatically break up the frame into columns spread over frameTime (ms)
@@ -868,8 +1790,8 @@ class LEDPOV(LEDMatrix):
 
 class LEDCircle(LEDBase):
 
-    def __init__(self, driver, rings, maxAngleDiff = 0, rotation = 0, threadedUpdate = False, masterBrightness=255, masterBrightnessLimit=255):
-        super(LEDCircle, self).__init__(driver, threadedUpdate, masterBrightness, masterBrightnessLimit)
+    def __init__(self, driver, rings, maxAngleDiff = 0, rotation = 0, threadedUpdate = False, masterBrightness=255, masterBrightnessLimit=255, compactBuffer=False):
+        super(LEDCircle, self).__init__(driver, threadedUpdate, masterBrightness, masterBrightnessLimit, compactBuffer)
         self.rings = rings
         self.maxAngleDiff = maxAngleDiff
         self._full_coords = False
@@ -1015,6 +1937,13 @@ MANIFEST = [
                 "max": 255,
                 "default": 255,
                 "help":"Master brightness limit for display, 0-255"
+            },{
+                "id": "compactBuffer",
+                "label": "Compact Buffer",
+                "group": "Advanced",
+                "type": "bool",
+                "default": False,
+                "help":"Store pixel data in a bytearray. Uses less memory and is faster for large displays but colors must be ints 0-255."
             }]
         },
         {
@@ -1105,6 +2034,13 @@ MANIFEST = [
                 ],
                 "default": [1,1],
                 "help":"Pixel scaling amount. Each logical pixel will be Width*Height LEDs in size."
+            },{
+                "id": "compactBuffer",
+                "label": "Compact Buffer",
+                "group": "Advanced",
+                "type": "bool",
+                "default": False,
+                "help":"Store pixel data in a bytearray. Uses less memory and is faster for large displays but colors must be ints 0-255."
             },]
         }
 ]
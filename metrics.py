@@ -0,0 +1,82 @@
+import math
+from array import array
+
+
+class FrameMetrics(object):
+    """
+    Per-frame timings, in ms, of the stages of an animation's run loop,
+    kept for the last size frames in preallocated ring buffers so that
+    recording a frame allocates nothing.
+    step - time in preStep(), step() and postStep()
+    fix - time drivers spent converting the frame for output in _fixData()
+    send - time in update(), less the fix time
+    sleep - time waiting for the next frame
+    frame - total time of the frame, the inverse of the achieved framerate
+    """
+    STAGES = ("step", "fix", "send", "sleep", "frame")
+
+    def __init__(self, size=512):
+        self.size = max(1, size)
+        self._rings = dict((s, array('d', [0.0]) * self.size) for s in self.STAGES)
+        self.reset()
+
+    def reset(self):
+        """Forgets all recorded frames"""
+        self._pos = 0
+        self.frames = 0
+        self.overruns = 0
+
+    def record(self, step, fix, send, sleep, frame, overrun=False):
+        i = self._pos
+        r = self._rings
+        r["step"][i] = step
+        r["fix"][i] = fix
+        r["send"][i] = send
+        r["sleep"][i] = sleep
+        r["frame"][i] = frame
+        self._pos = (i + 1) % self.size
+        self.frames += 1
+        if overrun:
+            self.overruns += 1
+
+    def _values(self, stage):
+        ring = self._rings[stage]
+        if self.frames < self.size:
+            return ring[:self.frames]
+        return ring
+
+    def percentiles(self, stage, percents=(50, 95, 99)):
+        """Returns {percent: ms} for stage over the frames in the buffers"""
+        values = sorted(self._values(stage))
+        if not values:
+            return dict((p, 0.0) for p in percents)
+        n = len(values)
+        return dict((p, values[min(n - 1, max(0, int(math.ceil(p / 100.0 * n)) - 1))]) for p in percents)
+
+    def mean(self, stage):
+        values = self._values(stage)
+        if not values:
+            return 0.0
+        return sum(values) / len(values)
+
+    def fps(self):
+        """Framerate achieved over the frames in the buffers"""
+        total = sum(self._values("frame"))
+        if total <= 0:
+            return 0.0
+        return min(self.frames, self.size) * 1000.0 / total
+
+    def summary(self):
+        """
+        Returns a dict of frames (total recorded), overruns, fps and for each
+        stage a dict of its mean, p50, p95 and p99 in ms
+        """
+        result = {
+            "frames": self.frames,
+            "overruns": self.overruns,
+            "fps": self.fps()
+        }
+        for s in self.STAGES:
+            p = self.percentiles(s)
+            result[s] = {"mean": self.mean(s), "p50": p[50], "p95": p[95], "p99": p[99]}
+        return result
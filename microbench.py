@@ -0,0 +1,289 @@
+"""
+Micro-benchmarks of the led.py drawing primitives and the driver encoders
+at display sizes from a 60 LED strip up to a 256x256 matrix.
+
+    python -m bibliopixel.microbench --save results.json
+    python -m bibliopixel.microbench --compare results.json
+
+Results are saved as JSON, the best time per call in microseconds for each
+case, so that runs from different versions can be compared number by number.
+"""
+import sys
+import os
+os.sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gc
+import json
+import random
+import fnmatch
+
+import log
+from led import LEDStrip, LEDMatrix
+from drivers.driver_base import DriverBase
+from drivers.APA102 import DriverAPA102
+from util import monotonic
+
+STRIP_SIZES = [60, 300, 1024]
+MATRIX_SIZES = [(8, 8), (32, 32), (64, 64), (256, 256)]
+# (name, LED count) of every display size, for cases that only need a count
+SIZES = ([("strip{}".format(n), n) for n in STRIP_SIZES] +
+    [("matrix{}x{}".format(w, h), w * h) for w, h in MATRIX_SIZES])
+
+CASES = []
+
+def case(name):
+    """
+    Registers a benchmark case. The decorated function is called with no
+    arguments to set the case up and returns the function to time, or a list
+    of (suffix, function) for a case run at several sizes
+    """
+    def register(setup):
+        CASES.append((name, setup))
+        return setup
+    return register
+
+def _points(w, h, count = 256):
+    r = random.Random(42)
+    return [(r.randrange(w), r.randrange(h)) for i in range(count)]
+
+def _matrix(w, h, **kwargs):
+    return LEDMatrix(DriverBase(num = w * h), width = w, height = h, **kwargs)
+
+def _frame(count):
+    r = random.Random(7)
+    return [r.randrange(256) for i in range(count * 3)]
+
+
+@case("led._set_base")
+def _setBase():
+    runs = []
+    for n in STRIP_SIZES:
+        led = LEDStrip(DriverBase(num = n))
+        pixels = [(i * 7) % n for i in range(256)]
+        def run(led = led, pixels = pixels):
+            s = led._set_base
+            for p in pixels:
+                s(p, (10, 20, 30))
+        runs.append(("strip{}".format(n), run))
+    return runs
+
+@case("LEDMatrix.set")
+def _matrixSet():
+    runs = []
+    for w, h in MATRIX_SIZES:
+        for rotation in range(4):
+            for px in (1, 2):
+                led = _matrix(w, h, rotation = rotation, pixelSize = (px, px))
+                points = _points(led.width, led.height)
+                def run(led = led, points = points):
+                    s = led.set
+                    for x, y in points:
+                        s(x, y, (10, 20, 30))
+                runs.append(("matrix{}x{}.rot{}.px{}".format(w, h, rotation * 90, px), run))
+    return runs
+
+@case("LEDMatrix.drawLine")
+def _drawLine():
+    runs = []
+    for w, h in MATRIX_SIZES:
+        led = _matrix(w, h)
+        def diagonal(led = led, w = w, h = h):
+            led.drawLine(0, 0, w - 1, h - 1, (10, 20, 30))
+        def horizontal(led = led, w = w, h = h):
+            led.drawLine(0, h / 2, w - 1, h / 2, (10, 20, 30))
+        runs.append(("matrix{}x{}.diagonal".format(w, h), diagonal))
+        runs.append(("matrix{}x{}.horizontal".format(w, h), horizontal))
+    return runs
+
+@case("LEDMatrix.fillRect")
+def _fillRect():
+    runs = []
+    for w, h in MATRIX_SIZES:
+        led = _matrix(w, h)
+        def inner(led = led, w = w, h = h):
+            led.fillRect(1, 1, w - 2, h - 2, (10, 20, 30))
+        def full(led = led, w = w, h = h):
+            led.fillRect(0, 0, w, h, (10, 20, 30))
+        runs.append(("matrix{}x{}.inner".format(w, h), inner))
+        runs.append(("matrix{}x{}.full".format(w, h), full))
+    return runs
+
+@case("LEDMatrix.drawText")
+def _drawText():
+    runs = []
+    for w, h in MATRIX_SIZES:
+        led = _matrix(w, h)
+        for size in (1, 2):
+            def run(led = led, size = size):
+                led.drawText("Hello", 0, 0, (10, 20, 30), size = size)
+            runs.append(("matrix{}x{}.size{}".format(w, h, size), run))
+    return runs
+
+@case("fill")
+def _fill():
+    runs = []
+    for n in STRIP_SIZES:
+        led = LEDStrip(DriverBase(num = n))
+        runs.append(("strip{}".format(n), lambda led = led: led.fill((10, 20, 30))))
+    for w, h in MATRIX_SIZES:
+        led = _matrix(w, h)
+        runs.append(("matrix{}x{}".format(w, h), lambda led = led: led.fillScreen((10, 20, 30))))
+    return runs
+
+@case("setBuffer.brightness")
+def _setBuffer():
+    runs = []
+    for size, n in SIZES:
+        for compact in (False, True):
+            led = LEDStrip(DriverBase(num = n), masterBrightness = 128, compactBuffer = compact)
+            frame = led._newBuffer(_frame(n))
+            runs.append(("{}{}".format(size, ".compact" if compact else ""), lambda led = led, frame = frame: led.setBuffer(frame)))
+    return runs
+
+@case("DriverBase._fixData")
+def _fixData():
+    runs = []
+    for size, n in SIZES:
+        d = DriverBase(num = n)
+        data = _frame(n)
+        runs.append((size, lambda d = d, data = data: d._fixData(data)))
+    return runs
+
+def _apa102(n):
+    # skip __init__, which opens the SPI device
+    d = DriverAPA102.__new__(DriverAPA102)
+    DriverBase.__init__(d, num = n)
+    d._latchBytes = int(n / 64.0) + 1
+    return d
+
+@case("DriverAPA102._fixData")
+def _apa102FixData():
+    runs = []
+    for size, n in SIZES:
+        d = _apa102(n)
+        data = _frame(n)
+        runs.append((size, lambda d = d, data = data: d._fixData(data)))
+    return runs
+
+@case("DriverSerial._buildPacket")
+def _serialPacket():
+    from drivers.serial_driver import DriverSerial
+    runs = []
+    for size, n in SIZES:
+        if n * 3 > 0xFFFF:
+            continue # more than a packet can hold
+        # skip __init__, which connects to the device
+        d = DriverSerial.__new__(DriverSerial)
+        DriverBase.__init__(d, num = n)
+        d._bufPad = 0
+        data = _frame(n)
+        runs.append((size, lambda d = d, data = data: d._buildPacket(data)))
+    return runs
+
+
+def timeCall(func, minTime = 0.2, repeat = 3):
+    """Returns the best time in us of one call of func, over repeat runs of at least minTime seconds"""
+    number = 1
+    while True:
+        start = monotonic()
+        for i in range(number):
+            func()
+        elapsed = monotonic() - start
+        if elapsed >= minTime / 10 or number >= 1 << 20:
+            break
+        number *= 10
+    number = max(1, int(number * (minTime / max(elapsed, 1e-9))))
+
+    best = None
+    gcWasEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        for r in range(repeat):
+            start = monotonic()
+            for i in range(number):
+                func()
+            t = (monotonic() - start) / number
+            if best is None or t < best:
+                best = t
+    finally:
+        if gcWasEnabled:
+            gc.enable()
+    return best * 1e6
+
+def run(pattern = "*", minTime = 0.2, repeat = 3, out = None):
+    """Runs every case matching pattern, returning {case name: us per call}"""
+    results = {}
+    for name, setup in CASES:
+        try:
+            runs = setup()
+        except ImportError as e:
+            log.logger.warning("Skipping {}: {}".format(name, e))
+            continue
+        if callable(runs):
+            runs = [("", runs)]
+        for suffix, func in runs:
+            full = "{}.{}".format(name, suffix) if suffix else name
+            if not fnmatch.fnmatch(full, pattern):
+                continue
+            results[full] = timeCall(func, minTime, repeat)
+            if out:
+                out.write("{:60} {:12.2f} us\n".format(full, results[full]))
+                out.flush()
+    return results
+
+def compare(results, baseline, threshold = 0.1):
+    """
+    Returns a list of (name, baseline us, current us, ratio) for every case
+    in both, and the names of those more than threshold slower
+    """
+    rows = []
+    slower = []
+    for name in sorted(results):
+        if name in baseline["results"]:
+            old = baseline["results"][name]
+            new = results[name]
+            ratio = new / old if old else 0.0
+            rows.append((name, old, new, ratio))
+            if ratio > 1 + threshold:
+                slower.append(name)
+    return rows, slower
+
+def main(argv = None):
+    import argparse
+    import platform
+    import time
+    parser = argparse.ArgumentParser(description = "Micro-benchmarks of BiblioPixel drawing and driver hot paths")
+    parser.add_argument("--filter", default = "*", help = "only run cases whose name matches this glob")
+    parser.add_argument("--min-time", type = float, default = 0.2, help = "seconds to time each case for")
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--save", metavar = "FILE", help = "save the results as JSON")
+    parser.add_argument("--compare", metavar = "FILE", help = "compare against results saved earlier")
+    parser.add_argument("--threshold", type = float, default = 0.1, help = "slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    package = sys.modules.get(__package__ or __name__.rpartition(".")[0])
+    results = run(args.filter, args.min_time, args.repeat, sys.stdout)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "version": getattr(package, "VERSION", None),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "results": results
+            }, f, indent = 2, sort_keys = True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows, slower = compare(results, baseline, args.threshold)
+        print("\nCompared to version {} ({}):".format(baseline.get("version"), baseline.get("time")))
+        for name, old, new, ratio in rows:
+            print("{:60} {:10.2f} -> {:10.2f} us  x{:.2f}{}".format(name, old, new, ratio, "  SLOWER" if name in slower else ""))
+        if slower:
+            print("{} case(s) more than {:.0%} slower".format(len(slower), args.threshold))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
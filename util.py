@@ -57,3 +57,159 @@ def genVector(width, height, x_mult = 1, y_mult = 1):
     centerY = (height - 1) / 2.0
 
     return [[int(math.sqrt(math.pow(x - centerX, 2*x_mult) + math.pow(y - centerY, 2*y_mult))) for x in range(width)] for y in range(height)]
+
+import threading
+import Queue
+import collections
+
+class LRUCache(object):
+    """
+    Cache that drops the least recently used entries once it holds more than
+    maxSize of them, or more than maxSize in total if sizeOf(value) is given.
+    onEvict(key, value) is called for each entry dropped to make room
+    """
+    def __init__(self, maxSize, sizeOf=None, onEvict=None):
+        self.maxSize = maxSize
+        self.size = 0
+        self._sizeOf = sizeOf
+        self._onEvict = onEvict
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _measure(self, value):
+        return self._sizeOf(value) if self._sizeOf else 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def put(self, key, value):
+        evicted = []
+        with self._lock:
+            if key in self._data:
+                self.size -= self._measure(self._data.pop(key))
+            self._data[key] = value
+            self.size += self._measure(value)
+            while self.size > self.maxSize and len(self._data) > 1:
+                k, v = self._data.popitem(last=False)
+                self.size -= self._measure(v)
+                evicted.append((k, v))
+        if self._onEvict:
+            for k, v in evicted:
+                self._onEvict(k, v)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+            self.size -= self._measure(value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+class poolJob(object):
+    """Result of a function submitted to a workerPool"""
+    def __init__(self, func, args):
+        self._func = func
+        self._args = args
+        self._done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def _run(self):
+        try:
+            self.result = self._func(*self._args)
+        except Exception as e:
+            self.error = e
+        self._done.set()
+
+    def done(self):
+        return self._done.isSet()
+
+    def wait(self):
+        """Blocks until the job has run, re-raising any exception it raised"""
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class workerPool(object):
+    """A fixed set of persistent daemon threads that run submitted functions"""
+    def __init__(self, workers):
+        self._queue = Queue.Queue()
+        self._threads = []
+        for i in range(max(1, workers)):
+            t = threading.Thread(target=self._work)
+            t.setDaemon(True)
+            t.start()
+            self._threads.append(t)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            job._run()
+
+    def submit(self, func, *args):
+        """Queue func(*args) to run on the pool and return its poolJob"""
+        job = poolJob(func, args)
+        self._queue.put(job)
+        return job
+
+    def map(self, func, items):
+        """Run func on every item concurrently and wait for them all"""
+        return [j.wait() for j in [self.submit(func, i) for i in items]]
+
+    def stop(self):
+        for t in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+import time
+
+def _clockGettime():
+    """returns a CLOCK_MONOTONIC reader using libc through ctypes, or None"""
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        clock_gettime = libc.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        CLOCK_MONOTONIC = 1
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(timespec())) != 0:
+            return None
+
+        def monotonic():
+            ts = timespec()
+            clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts))
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+        return monotonic
+    except (ImportError, OSError, AttributeError):
+        return None
+
+# monotonic() returns seconds from an arbitrary start that never go
+# backwards, for measuring intervals. Falls back to time.time where no
+# monotonic clock is available
+monotonic = getattr(time, "monotonic", None) or _clockGettime() or time.time